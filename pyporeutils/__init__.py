@@ -0,0 +1,7 @@
+"""
+Readers and analysis tools for HEKA nanopore recordings
+
+The modules are imported on their own, eg ``from pyporeutils import
+heka_reader``, so reading data only needs numpy. The command line interface
+is pyporeutils.cli, installed as the pyporeutils command.
+"""
@@ -0,0 +1,166 @@
+#!/usr/bin/env python
+
+"""
+Time the reader and analysis pipelines on synthetic files of several sizes
+
+Every stage is timed repeat times, keeping the fastest run, and then run
+once more under tracemalloc for its peak memory. Results can be saved as
+JSON and compared with an earlier run to catch regressions.
+"""
+
+import json
+import os
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+from . import heka_reader as heka
+from . import synthetic
+
+def header_stage(fname):
+    reader = heka.HekaReader(fname)
+    reader.close_file()
+
+def full_decode_stage(fname):
+    reader = heka.HekaReader(fname)
+    reader.get_all_data()
+    reader.close_file()
+
+def window_decode_stage(fname, duration = 1.0):
+    reader = heka.HekaReader(fname)
+    middle = reader.points_per_channel_total//2
+    half = int(duration*reader.get_sample_rate()/2)
+    reader.read_samples(middle - half, middle + half)
+    reader.close_file()
+
+def window_extract_stage(fname, duration = 1.0):
+    reader = heka.HekaReader(fname)
+    middle = reader.points_per_channel_total/reader.get_sample_rate()/2
+    reader.extract_data(middle - duration/2, middle + duration/2)
+    reader.close_file()
+
+def time_slice_stage(fname, duration = 1.0):
+    reader = heka.HekaReader(fname)
+    middle = reader.points_per_channel_total/reader.get_sample_rate()/2
+    reader.time_slice(middle - duration/2, middle + duration/2)
+    reader.close_file()
+
+def window_int16_stage(fname, duration = 1.0):
+    reader = heka.HekaReader(fname)
+    middle = reader.points_per_channel_total//2
+    half = int(duration*reader.get_sample_rate()/2)
+    reader.read_samples(middle - half, middle + half, dtype = np.int16)
+    reader.close_file()
+
+def decimate_stage(fname, factor = 2500):
+    reader = heka.HekaReader(fname)
+    reader.get_decimated_data(factor)
+    reader.close_file()
+
+def psd_stage(fname):
+    from . import noise
+    reader = heka.HekaReader(fname, prefetch = 2)
+    noise.noise_psd_stream(reader).result()
+    reader.close_file()
+
+def iv_stage(fname):
+    from . import plot_all_iv
+    plot_all_iv.avg_currents(*plot_all_iv.load_hkr(fname))
+
+HKD_STAGES = [['header', header_stage], ['full decode', full_decode_stage], ['window decode', window_decode_stage],
+              ['window extract', window_extract_stage], ['time slice', time_slice_stage],
+              ['window int16', window_int16_stage], ['decimate', decimate_stage], ['psd', psd_stage]]
+HKR_STAGES = [['iv parse', iv_stage]]
+
+def time_stage(stage, fname, repeat = 3):
+    """Time one stage on one file
+
+    :param stage: Function taking the filename
+    :param fname: File to be processed
+    :param repeat: Number of timed runs, the fastest is kept (Default = 3)
+    :returns: [seconds, peak_bytes]
+
+    """
+    seconds = np.inf
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        stage(fname)
+        seconds = min(seconds, time.perf_counter() - t0)
+    tracemalloc.start()
+    try:
+        stage(fname)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return [seconds, peak]
+
+def run_benchmarks(durations = [10, 60], repeat = 3, directory = None, stages = None, **options):
+    """Write synthetic files of each duration and time every stage on them
+
+    :param durations: Lengths in s of the .hkd files; .hkr files get 1000 rows per s (Default = [10, 60])
+    :param repeat: Number of timed runs per stage (Default = 3)
+    :param directory: Where the files are written, a temporary directory if None (Default = None)
+    :param stages: Names of the stages to run, all if None (Default = None)
+    :param options: synthetic.write_hkd keyword arguments, eg sample_rate, channels
+    :returns: List of dicts with stage, duration, file_bytes, seconds, mb_per_s and peak_mb
+
+    """
+    results = []
+    with tempfile.TemporaryDirectory(dir = directory) as tmp:
+        for duration in durations:
+            hkd = os.path.join(tmp, 'bench_%gs.hkd' % duration)
+            hkr = os.path.join(tmp, 'bench_%gs.hkr' % duration)
+            synthetic.write_hkd(hkd, duration, **options)
+            synthetic.write_hkr(hkr, np.linspace(-1, 1, 41), repeats = max(1, int(duration*1000/41)))
+            for (name, stage), fname in [[s, hkd] for s in HKD_STAGES] + [[s, hkr] for s in HKR_STAGES]:
+                if stages is not None and name not in stages:
+                    continue
+                seconds, peak = time_stage(stage, fname, repeat)
+                size = os.path.getsize(fname)
+                results.append({'stage': name, 'duration': duration, 'file_bytes': size, 'seconds': seconds,
+                                'mb_per_s': size/seconds/1e6, 'peak_mb': peak/1e6})
+    return results
+
+def compare_results(results, baseline, tolerance = 0.2):
+    """Stages slower than in baseline by more than tolerance
+
+    :param results: Output of run_benchmarks
+    :param baseline: Earlier output of run_benchmarks, eg loaded from JSON
+    :param tolerance: Allowed relative slowdown (Default = 0.2)
+    :returns: List of [stage, duration, baseline seconds, seconds]
+
+    """
+    previous = {(r['stage'], r['duration']): r['seconds'] for r in baseline}
+    slower = []
+    for r in results:
+        key = (r['stage'], r['duration'])
+        if key in previous and r['seconds'] > previous[key]*(1 + tolerance):
+            slower.append([r['stage'], r['duration'], previous[key], r['seconds']])
+    return slower
+
+def print_results(results):
+    print("%-14s %10s %10s %10s %10s" % ('stage', 'duration', 'seconds', 'MB/s', 'peak MB'))
+    for r in results:
+        print("%-14s %9gs %10.4f %10.1f %10.1f" % (r['stage'], r['duration'], r['seconds'], r['mb_per_s'], r['peak_mb']))
+
+def benchmark_main(args):
+    """Run the benchmarks for the pyporeutils benchmark command"""
+    results = run_benchmarks(args.durations, args.repeat, args.directory, args.stages,
+                             sample_rate = args.sample_rate, channels = args.channels)
+    print_results(results)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent = 1)
+    if args.compare:
+        with open(args.compare) as f:
+            slower = compare_results(results, json.load(f), args.tolerance)
+        for stage, duration, before, after in slower:
+            print("Regression: %s (%gs file) %.4f s -> %.4f s" % (stage, duration, before, after))
+        return 1 if slower else 0
+    return 0
+
+if __name__ == '__main__':
+    from . import cli
+    cli.main(['benchmark'])
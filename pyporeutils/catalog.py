@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+
+"""
+Catalog .hkd files from their headers, without decoding any samples
+"""
+
+import csv
+import glob
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from . import heka_reader as heka
+
+CATALOG_COLUMNS = ['file', 'file_size', 'channels', 'sample_rate', 'block_size', 'blocks', 'duration',
+                   'voltages', 'error']
+
+def to_python(value):
+    """Convert a numpy header value to a JSON friendly python value"""
+    if isinstance(value, bytes):
+        return value.decode('utf-8', 'replace')
+    if isinstance(value, np.generic):
+        return to_python(value.item())
+    return value
+
+def catalog_file(fname, channel = 0):
+    """Parameters, block geometry and voltage protocol of one .hkd file
+
+    :param fname: Filename of the .hkd file
+    :param channel: Index or name of the channel whose voltage protocol is returned (Default = 0)
+    :returns: Dictionary with the CATALOG_COLUMNS, the per file parameters under
+        params and the voltage protocol under plateaus as [start, stop, voltage]
+        in s and V; error holds the reason a file could not be read
+
+    """
+    entry = dict((column, '') for column in CATALOG_COLUMNS)
+    entry.update(file = fname, params = {}, plateaus = [])
+    try:
+        with heka.HekaReader(fname, use_index = 'if-valid') as reader:
+            fs = reader.get_sample_rate()
+            entry.update(file_size = reader.file_size, channels = reader.get_channel_names(),
+                         sample_rate = float(fs), block_size = reader.block_size,
+                         blocks = reader.num_blocks_in_file, duration = reader.points_per_channel_total/fs)
+            entry['params'] = dict((to_python(name), to_python(value)) for name, value in reader.per_file_params.items())
+            # block headers only, from a valid sidecar index if there is one,
+            # else read block by block without touching the samples
+            entry['plateaus'] = [[first/fs, last/fs, voltage]
+                                 for first, last, voltage in reader.get_voltage_plateaus(channel)]
+            entry['voltages'] = sorted(set(voltage for first, last, voltage in entry['plateaus']))
+    except Exception as e:  # keep going with the other files
+        entry['error'] = "%s: %s" % (type(e).__name__, e)
+    return entry
+
+def expand_files(patterns):
+    """Filenames matching glob patterns or below directories, sorted and without duplicates
+
+    :param patterns: List of .hkd filenames, glob patterns or directories searched recursively
+    :returns: List of filenames
+
+    """
+    files = []
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            files.extend(glob.glob(os.path.join(pattern, '**', '*.hkd'), recursive = True))
+        else:
+            files.extend(glob.glob(pattern) or [pattern])
+    return sorted(set(files))
+
+def catalog(patterns, threads = 16, channel = 0, output = None):
+    """Catalog many .hkd files in parallel
+
+    Scanning headers is bound by file system latency rather than CPU, so files
+    are read from a pool of threads.
+
+    :param patterns: List of .hkd filenames, glob patterns or directories searched recursively
+    :param threads: Number of files read at once (Default = 16)
+    :param channel: Index or name of the channel whose voltage protocol is returned (Default = 0)
+    :param output: Filename of a .json or .csv catalog to write (Default = None)
+    :returns: List of catalog_file dictionaries, sorted by filename
+
+    """
+    files = expand_files(patterns)
+    with ThreadPoolExecutor(max_workers = threads) as pool:
+        entries = list(pool.map(lambda fname: catalog_file(fname, channel), files))
+    if output is not None:
+        write_catalog(entries, output)
+    return entries
+
+def write_catalog(entries, fname):
+    """Save a catalog as .json, with every field, or as a .csv table with one row per file
+
+    In the .csv table, channels and voltages are joined with ';' and every
+    per file parameter gets its own column.
+
+    :param entries: List of catalog_file dictionaries
+    :param fname: Filename ending in .json or .csv
+
+    """
+    if fname.endswith('.json'):
+        with open(fname, 'w') as f:
+            json.dump(entries, f, indent = 1)
+        return
+    param_names = sorted(set(name for entry in entries for name in entry['params']))
+    with open(fname, 'w', newline = '') as f:
+        writer = csv.writer(f)
+        writer.writerow(CATALOG_COLUMNS + param_names)
+        for entry in entries:
+            row = [entry[column] for column in CATALOG_COLUMNS]
+            row[CATALOG_COLUMNS.index('channels')] = ';'.join(entry['channels'])
+            row[CATALOG_COLUMNS.index('voltages')] = ';'.join('%g' % v for v in entry['voltages'])
+            writer.writerow(row + [entry['params'].get(name, '') for name in param_names])
@@ -0,0 +1,259 @@
+#!/usr/bin/env python
+
+"""
+Command line interface to the pyporeutils analyses
+
+Usage: pyporeutils {read,catalog,export,noise,iv,trace,events,rolling,geometry,benchmark} ...
+
+Only argparse is imported up front; each command imports the modules it
+needs when it runs, so startup stays fast.
+"""
+
+import argparse
+import sys
+
+def read_command(args):
+    """Print the parameters and layout of .hkd files without decoding samples"""
+    from . import heka_reader as heka
+    for fname in args.files:
+        reader = heka.HekaReader(fname, use_index = args.index)
+        print(fname)
+        print("  Channels: %s" % ", ".join(name.decode('utf-8') for name, _ in reader.channel_list))
+        print("  Sample rate: %g Hz" % reader.get_sample_rate())
+        print("  Points per block: %d" % reader.block_size)
+        print("  Blocks: %d" % reader.num_blocks_in_file)
+        print("  Duration: %g s" % (reader.points_per_channel_total/reader.get_sample_rate()))
+        for name, value in reader.per_file_params.items():
+            print("  %s: %s" % (name.decode('utf-8'), value))
+        if args.plateaus:
+            print("  Voltage plateaus (start s, stop s, V):")
+            for first, last, voltage in reader.get_voltage_plateaus():
+                print("    %g\t%g\t%g" % (first/reader.get_sample_rate(), last/reader.get_sample_rate(), voltage))
+        reader.close_file()
+
+def catalog_command(args):
+    """Catalog parameters, geometry and voltage protocol of many .hkd files"""
+    from . import catalog
+    entries = catalog.catalog(args.paths, args.threads, args.channel, args.output)
+    for entry in entries:
+        if entry['error']:
+            print("%s: %s" % (entry['file'], entry['error']))
+    print("%d files catalogued, catalog in %s" % (len(entries), args.output))
+
+def export_command(args):
+    """Rewrite a .hkd file as a columnar store for fast repeated reads"""
+    from . import columnar
+    manifest = columnar.export_columnar(args.file, args.directory, args.chunk_size, args.compress, args.level)
+    print("%s: %d channels, %d samples each, written to %s" % (args.file, len(manifest['channels']),
+                                                             manifest['points'], args.directory))
+
+def noise_command(args):
+    """Batch 1/f noise analysis of windows, voltage plateaus or spectrograms of .hkd files"""
+    from . import noise
+    tasks = noise.expand_noise_files(args.files, args.window)
+    if args.plateaus:
+        results = []
+        for fname, window in tasks:
+            results.extend(noise.plateau_noise(fname, args.noise_lims, args.threshold, args.settle,
+                                               processes = args.processes, refine = not args.log_fit))
+        noise.write_noise_table(results, args.output, noise.PLATEAU_TABLE_COLUMNS)
+    elif args.spectrogram:
+        import os
+        results = []
+        for fname, window in tasks:
+            output = os.path.splitext(fname)[0] + '_spectrogram.npz'
+            results.extend(noise.noise_spectrogram(fname, args.spectrogram, window[0], window[1], args.noise_lims,
+                                                   args.threshold, processes = args.processes, output = output,
+                                                   refine = not args.log_fit)[3])
+            print("%s: spectrogram in %s" % (fname, output))
+        noise.write_noise_table(results, args.output, noise.PLATEAU_TABLE_COLUMNS)
+    else:
+        results = noise.noise_batch(tasks, args.noise_lims, args.threshold, args.processes, args.output,
+                                    refine = not args.log_fit)
+    for result in results:
+        if result['error']:
+            print("%s: %s" % (result['file'], result['error']))
+    print("%d windows analysed, results in %s" % (len(results), args.output))
+
+def iv_command(args):
+    """Plot and save IV data of .hkr files, or of every .hkr file below directories"""
+    import os
+    from . import plot_all_iv
+    options = dict(save_data = not args.no_data, didv = args.didv, fit = args.fit, invert = args.invert,
+                   limit = args.limit or [])
+    for path in args.paths:
+        if os.path.isdir(path):
+            summary = plot_all_iv.batch_plot(path, args.sub_folder, args.processes, args.force, **options)
+            print("%s: %d plotted, %d up to date, %d failed" % (path, len(summary['plotted']),
+                                                               len(summary['skipped']), len(summary['failed'])))
+        else:
+            plot_all_iv.plot_iv(path, save_plot = args.save, **options)
+
+def trace_command(args):
+    """Plot the current and voltage trace of a .hkd file"""
+    from . import time_trace
+    time_trace.plot_trace(args.file, args.start, args.stop, not args.no_decimate, args.dec_rate, args.output,
+                          use_index = args.index)
+
+def events_command(args):
+    """Detect translocation events in .hkd files and save an event table for each"""
+    import os
+    from . import events
+    for fname in args.files:
+        output = args.output if args.output and len(args.files) == 1 else os.path.splitext(fname)[0] + '_events.csv'
+        table = events.detect_events(fname, args.start, args.stop, args.processes, args.overlap, args.channel,
+                                     output = output, threshold = args.threshold, end_threshold = args.end_threshold,
+                                     baseline_window = args.baseline_window, min_duration = args.min_duration)
+        print("%s: %d events, table in %s" % (fname, len(table), output))
+
+def rolling_command(args):
+    """Save the rolling current statistics of .hkd files, one table for each"""
+    import os
+    from . import rolling
+    for fname in args.files:
+        output = args.output if args.output and len(args.files) == 1 else os.path.splitext(fname)[0] + '_rolling.csv'
+        table = rolling.rolling_stats(fname, args.window, args.step, args.start, args.stop, args.channel,
+                                      args.percentiles, output = output)
+        print("%s: %d windows, table in %s" % (fname, len(table), output))
+
+def geometry_command(args):
+    """Estimate pore diameter and thickness from conductances"""
+    from . import t_d_opt
+    t_d_opt.t_d_opt(args.g0, args.dg, args.sig, args.dnp, args.dmax, plot = args.plot)
+    if args.plot:
+        import matplotlib.pyplot as plt
+        plt.show()
+
+def benchmark_command(args):
+    """Time the reader and analyses on synthetic files"""
+    from . import benchmark
+    sys.exit(benchmark.benchmark_main(args))
+
+def get_parser():
+    parser = argparse.ArgumentParser(prog = 'pyporeutils', description = 'Nanopore data analysis tools')
+    parser.add_argument('--profile', default = None, metavar = 'FILE',
+                        help = 'save stage timings and counters of the run as JSON')
+    parser.add_argument('--profile-memory', action = 'store_true', help = 'also record peak memory of each stage')
+    commands = parser.add_subparsers(dest = 'command', metavar = 'command')
+    commands.required = True
+
+    read = commands.add_parser('read', help = 'show parameters of .hkd files')
+    read.add_argument('files', nargs = '+', help = '.hkd files')
+    read.add_argument('--plateaus', action = 'store_true', help = 'also list the voltage plateaus')
+    read.add_argument('--index', action = 'store_true', help = 'read block headers from the sidecar index, building it if needed')
+    read.set_defaults(func = read_command)
+
+    catalog = commands.add_parser('catalog', help = 'catalog .hkd files from their headers')
+    catalog.add_argument('paths', nargs = '+', help = '.hkd files, glob patterns or directories searched recursively')
+    catalog.add_argument('--channel', type = int, default = 0, help = 'channel whose voltage protocol is listed')
+    catalog.add_argument('--threads', type = int, default = 16, help = 'number of files read at once')
+    catalog.add_argument('--output', default = 'catalog.csv', help = 'catalog table (.csv) or full catalog (.json)')
+    catalog.set_defaults(func = catalog_command)
+
+    export = commands.add_parser('export', help = 'rewrite a .hkd file as a columnar store')
+    export.add_argument('file', help = '.hkd file')
+    export.add_argument('directory', help = 'directory of the store')
+    export.add_argument('--chunk-size', type = int, default = 2**20, help = 'samples per channel in a chunk')
+    export.add_argument('--compress', action = 'store_true', help = 'zlib compress every chunk')
+    export.add_argument('--level', type = int, default = 1, help = 'zlib compression level')
+    export.set_defaults(func = export_command)
+
+    noise = commands.add_parser('noise', help = 'batch 1/f noise analysis of .hkd files')
+    noise.add_argument('files', nargs = '+', help = '.hkd files or glob patterns, optionally suffixed with @start:stop (s)')
+    noise.add_argument('--window', nargs = 2, type = float, default = [0, 0], metavar = ('START', 'STOP'),
+                       help = 'time window in s for files without their own (default: entire range)')
+    noise.add_argument('--noise-lims', nargs = 2, type = float, default = [3, 1e3], metavar = ('FMIN', 'FMAX'),
+                       help = 'frequency range in Hz of the 1/f fit')
+    noise.add_argument('--threshold', type = float, default = 0, help = 'PSD outlier threshold (default: off)')
+    noise.add_argument('--log-fit', action = 'store_true',
+                       help = 'keep the closed form log-log 1/f fit instead of refining it by least squares on the PSD')
+    noise.add_argument('--plateaus', action = 'store_true', help = 'analyse every constant voltage plateau instead of a window')
+    noise.add_argument('--spectrogram', type = float, default = None, metavar = 'SECONDS',
+                       help = 'analyse consecutive windows of this length, saving <file>_spectrogram.npz')
+    noise.add_argument('--settle', type = float, default = 0, help = 'time in s skipped at the start of every plateau')
+    noise.add_argument('--processes', type = int, default = None, help = 'number of worker processes')
+    noise.add_argument('--output', default = 'noise_results.csv', help = 'results table (.csv)')
+    noise.set_defaults(func = noise_command)
+
+    iv = commands.add_parser('iv', help = 'plot and save IV data of .hkr files')
+    iv.add_argument('paths', nargs = '+', help = '.hkr files, or directories processed recursively')
+    iv.add_argument('--sub-folder', default = '', help = 'subdirectory for outputs of directories, e.g. /IV')
+    iv.add_argument('--processes', type = int, default = None, help = 'number of worker processes for directories')
+    iv.add_argument('--force', action = 'store_true', help = 'reprocess files that are up to date')
+    iv.add_argument('--save', action = 'store_true', help = 'save plots of single files instead of showing them')
+    iv.add_argument('--no-data', action = 'store_true', help = "don't save .csv data")
+    iv.add_argument('--didv', action = 'store_true', help = 'also plot dI/dV')
+    iv.add_argument('--fit', action = 'store_true', help = 'plot the linear fit')
+    iv.add_argument('--invert', action = 'store_true', help = 'invert current and voltage')
+    iv.add_argument('--limit', nargs = 2, type = float, metavar = ('V1', 'V2'), help = 'voltage range in V to keep')
+    iv.set_defaults(func = iv_command)
+
+    trace = commands.add_parser('trace', help = 'plot the current and voltage trace of a .hkd file')
+    trace.add_argument('file', help = '.hkd file')
+    trace.add_argument('--start', type = float, default = 0, help = 'start of the window in s')
+    trace.add_argument('--stop', type = float, default = 0, help = 'end of the window in s (default: end of file)')
+    trace.add_argument('--no-decimate', action = 'store_true', help = 'plot every sample')
+    trace.add_argument('--dec-rate', type = int, default = 2500, help = 'samples per decimation bin')
+    trace.add_argument('--output', default = None, help = 'save the plot to this file instead of showing it')
+    trace.add_argument('--index', action = 'store_true',
+                       help = 'plot the envelope from the sidecar index, building it if needed; rounds --dec-rate up to whole blocks')
+    trace.set_defaults(func = trace_command)
+
+    events = commands.add_parser('events', help = 'detect translocation events in .hkd files')
+    events.add_argument('files', nargs = '+', help = '.hkd files')
+    events.add_argument('--start', type = float, default = 0, help = 'start of the window in s')
+    events.add_argument('--stop', type = float, default = 0, help = 'end of the window in s (default: end of file)')
+    events.add_argument('--channel', type = int, default = 0, help = 'index of the channel to analyse')
+    events.add_argument('--threshold', type = float, default = 5, help = 'deviation in noise levels that starts an event')
+    events.add_argument('--end-threshold', type = float, default = 1, help = 'deviation in noise levels that ends an event')
+    events.add_argument('--baseline-window', type = float, default = 0.1, help = 'time in s the baseline is estimated over')
+    events.add_argument('--min-duration', type = float, default = 0, help = 'shortest event kept, in s')
+    events.add_argument('--processes', type = int, default = 1, help = 'number of worker processes')
+    events.add_argument('--overlap', type = float, default = 1, help = 'time in s shared by the ranges of workers')
+    events.add_argument('--output', default = None, help = 'event table (.csv) for a single file (default: <file>_events.csv)')
+    events.set_defaults(func = events_command)
+
+    rolling = commands.add_parser('rolling', help = 'rolling baseline and RMS statistics of .hkd files')
+    rolling.add_argument('files', nargs = '+', help = '.hkd files')
+    rolling.add_argument('--window', type = float, default = 1, help = 'length of each window in s')
+    rolling.add_argument('--step', type = float, default = None, help = 'time in s between window starts (default: window)')
+    rolling.add_argument('--start', type = float, default = 0, help = 'start of the range in s')
+    rolling.add_argument('--stop', type = float, default = 0, help = 'end of the range in s (default: end of file)')
+    rolling.add_argument('--channel', type = int, default = 0, help = 'index of the channel to analyse')
+    rolling.add_argument('--percentiles', nargs = '+', type = float, default = [], help = 'percentiles of each window, eg 5 50 95')
+    rolling.add_argument('--output', default = None, help = 'table (.csv) for a single file (default: <file>_rolling.csv)')
+    rolling.set_defaults(func = rolling_command)
+
+    geometry = commands.add_parser('geometry', help = 'pore diameter and thickness from conductances')
+    geometry.add_argument('g0', type = float, help = 'open pore conductance (nS)')
+    geometry.add_argument('dg', type = float, help = 'change in conductance during translocation (nS)')
+    geometry.add_argument('--sig', type = float, default = 11.8, help = 'solution conductivity (S/m)')
+    geometry.add_argument('--dnp', type = float, default = 2.15, help = 'nanoparticle diameter (nm)')
+    geometry.add_argument('--dmax', type = float, default = 10, help = 'maximum pore diameter (nm)')
+    geometry.add_argument('--plot', action = 'store_true', help = 'show the thickness curves')
+    geometry.set_defaults(func = geometry_command)
+
+    benchmark = commands.add_parser('benchmark', help = 'time the reader and analyses on synthetic files')
+    benchmark.add_argument('--durations', nargs = '+', type = float, default = [10, 60], help = 'lengths in s of the test files')
+    benchmark.add_argument('--repeat', type = int, default = 3, help = 'timed runs per stage, the fastest is kept')
+    benchmark.add_argument('--stages', nargs = '+', default = None, help = 'stages to run (default: all)')
+    benchmark.add_argument('--sample-rate', type = float, default = 1e5, help = 'sample rate in Hz of the test files')
+    benchmark.add_argument('--channels', type = int, default = 1, help = 'number of channels of the test files')
+    benchmark.add_argument('--directory', default = None, help = 'where the test files are written (default: temporary directory)')
+    benchmark.add_argument('--output', default = None, help = 'save the results as JSON')
+    benchmark.add_argument('--compare', default = None, help = 'JSON results of an earlier run; exit with 1 on regressions')
+    benchmark.add_argument('--tolerance', type = float, default = 0.2, help = 'allowed relative slowdown for --compare')
+    benchmark.set_defaults(func = benchmark_command)
+    return parser
+
+def main(argv = None):
+    args = get_parser().parse_args(sys.argv[1:] if argv is None else argv)
+    if args.profile is None:
+        args.func(args)
+        return
+    from . import instrument
+    with instrument.profile(args.profile_memory, args.profile):
+        args.func(args)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,282 @@
+#!/usr/bin/env python
+
+"""
+Columnar copies of .hkd recordings for fast repeated analysis
+
+A store is a directory holding, for each channel, the raw samples as
+little-endian int16 in fixed size chunks (contiguous, or each chunk zlib
+compressed), table.npz with the per block parameters (Scale, Voltage, ...)
+and block statistics, and manifest.json describing the recording.
+ColumnarReader reads a store with the HekaReader API.
+"""
+
+import json
+import os
+import tempfile
+import zlib
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from . import heka_reader as heka
+from . import instrument
+from . import catalog
+
+FORMAT_NAME = 'pyporeutils-columnar'
+FORMAT_VERSION = 1
+
+def export_columnar(fname, directory, chunk_size = 2**20, compress = False, level = 1, threads = 4):
+    """Rewrite a .hkd recording as a columnar store
+
+    :param fname: Filename of the .hkd file
+    :param directory: Directory of the store, created if needed
+    :param chunk_size: Samples per channel in a chunk (Default = 2**20)
+    :param compress: zlib compress every chunk (Default = False)
+    :param level: zlib compression level (Default = 1)
+    :param threads: Number of chunks compressed at once (Default = 4)
+    :returns: The manifest as a dictionary
+
+    """
+    os.makedirs(directory, exist_ok = True)
+    with heka.HekaReader(fname) as reader:
+        names = reader.get_channel_names()
+        files = ['channel_%d.%s' % (j, 'zlib' if compress else 'i2') for j in range(len(names))]
+        chunk_offsets = [[0] for _ in names]
+        outputs = [open(os.path.join(directory, name), 'wb') for name in files]
+        pool = ThreadPoolExecutor(max_workers = threads) if compress else None
+        try:
+            for first_sample in range(0, reader.points_per_channel_total, chunk_size):
+                last_sample = min(first_sample + chunk_size, reader.points_per_channel_total)
+                raw = [np.asarray(samples.raw, dtype = '<i2').tobytes()
+                       for samples in reader.read_samples(first_sample, last_sample, dtype = np.int16)]
+                if compress:  # zlib releases the GIL, so channels compress in parallel
+                    raw = list(pool.map(lambda data: zlib.compress(data, level), raw))
+                for j, data in enumerate(raw):
+                    outputs[j].write(data)
+                    chunk_offsets[j].append(chunk_offsets[j][-1] + len(data))
+        finally:
+            for output in outputs:
+                output.close()
+            if pool is not None:
+                pool.shutdown()
+
+        table = {'chunk_offsets': np.asarray(chunk_offsets, dtype = np.int64)}
+        for name in reader.block_dtype['channel'].base.names:
+            table['channel.' + name] = np.ascontiguousarray(reader.get_block_channel_params(name), dtype = np.float64)
+        table['max'], table['min'], table['mean'], table['sum_squares'] = reader.compute_block_stats()
+        np.savez(os.path.join(directory, 'table.npz'), **table)
+
+        manifest = {'format': FORMAT_NAME, 'version': FORMAT_VERSION, 'source': os.path.abspath(fname),
+                    'sample_rate': float(reader.get_sample_rate()), 'block_size': reader.block_size,
+                    'blocks': reader.num_blocks_in_file, 'points': reader.points_per_channel_total,
+                    'chunk_size': chunk_size, 'compression': 'zlib' if compress else None, 'dtype': '<i2',
+                    'channels': names, 'files': files,
+                    'per_file_params': dict((name.decode('utf-8'), catalog.to_python(np.asarray(value).item()))
+                                            for name, value in reader.per_file_params.items())}
+    # the manifest goes last and in one step, so a store is never left with half of one
+    handle, temp_fname = tempfile.mkstemp(dir = directory)
+    with os.fdopen(handle, 'w') as f:
+        json.dump(manifest, f, indent = 1)
+    os.replace(temp_fname, os.path.join(directory, 'manifest.json'))
+    return manifest
+
+class ColumnarReader(heka.HekaReader):
+    """
+    Reads a columnar store with the HekaReader API: read_samples, iter_chunks,
+    extract_data, get_all_data, get_decimated_data, the voltage and block
+    statistics methods and channel selection all work as for .hkd files.
+    Uncompressed stores are memory-mapped, so any sample range is read
+    directly; compressed chunks are decompressed in parallel and the most
+    recently used ones are cached for sequential reads. Reads spanning more
+    chunks than the cache holds are decompressed straight into the output.
+    """
+    def __init__(self, directory, prefetch = 0, threads = 4, cache_chunks = 8):
+        """
+        :param directory: Directory of a store written by export_columnar
+        :param prefetch: Number of chunks iter_chunks decodes ahead, see HekaReader (Default = 0)
+        :param threads: Number of chunks decompressed at once (Default = 4)
+        :param cache_chunks: Number of decompressed chunks kept, least recently used
+            dropped first (Default = 8)
+        """
+        with open(os.path.join(directory, 'manifest.json')) as f:
+            self.manifest = json.load(f)
+        if self.manifest.get('format') != FORMAT_NAME or self.manifest.get('version') != FORMAT_VERSION:
+            raise IOError('Columnar store format not recognized.')
+        self.filename = directory
+        self.prefetch = prefetch
+        self.prefetchers = set()
+        self.channel_list = [[bytes(name, 'utf-8'), np.dtype('>S512')] for name in self.manifest['channels']]
+        self.channel_list_number = len(self.channel_list)
+        self.per_file_params = dict((bytes(name, 'utf-8'), value)
+                                    for name, value in self.manifest['per_file_params'].items())
+        self.block_size = int(self.manifest['block_size'])
+        self.num_blocks_in_file = int(self.manifest['blocks'])
+        self.points_per_channel_total = int(self.manifest['points'])
+        self.sample_rate = self.manifest['sample_rate']
+        self.chunk_size = int(self.manifest['chunk_size'])
+        self.compressed = self.manifest['compression'] == 'zlib'
+        self.paths = [os.path.join(directory, name) for name in self.manifest['files']]
+        self.file_size = sum(os.path.getsize(path) for path in self.paths)
+
+        # per block parameters and statistics are served like a HekaReader index
+        with np.load(os.path.join(directory, 'table.npz')) as table:
+            self.index = dict((key, table[key]) for key in table.files)
+        self.use_index = True
+        self.threads = threads
+        self.cache_chunks = cache_chunks
+        self.cache = OrderedDict()
+        self.columns = None
+        self.pool = None
+        self.next_block = 0
+
+    def close_file(self):
+        for prefetcher in list(self.prefetchers):
+            prefetcher.close()
+        self.columns = None
+        self.cache = OrderedDict()
+        if self.pool is not None:
+            self.pool.shutdown()
+            self.pool = None
+
+    def get_sample_offset(self, sample, channel = 0):
+        """
+        :param sample: Index of a sample
+        :param channel: Index or name of the channel (Default = 0)
+        :returns: Offset in bytes of the sample in the file of its channel, see paths
+        """
+        if self.compressed:
+            raise ValueError('Samples of a compressed store have no fixed byte offset')
+        return int(sample) * 2
+
+    def get_columns(self):
+        """
+        :returns: List of the memory-mapped int16 samples of each channel, for uncompressed stores
+        """
+        if self.columns is None:
+            self.columns = [np.memmap(path, dtype='<i2', mode='r', shape=(self.points_per_channel_total,))
+                            if self.points_per_channel_total > 0 else np.zeros(0, dtype='<i2')
+                            for path in self.paths]
+        return self.columns
+
+    def get_pool(self):
+        """
+        :returns: Thread pool decompressing chunks; zlib releases the GIL, so they run in parallel
+        """
+        if self.pool is None:
+            self.pool = ThreadPoolExecutor(max_workers = self.threads)
+        return self.pool
+
+    def decompress_chunk(self, channel, chunk):
+        """
+        :returns: Decompressed int16 samples of a chunk of a channel
+        """
+        start, stop = self.index['chunk_offsets'][channel, chunk:chunk + 2]
+        with open(self.paths[channel], 'rb') as f:
+            f.seek(start)
+            return np.frombuffer(zlib.decompress(f.read(stop - start)), dtype='<i2')
+
+    def read_chunk(self, channel, chunk, data = None):
+        """
+        :param data: Samples of the chunk decompressed already (Default = None)
+        :returns: Decompressed int16 samples of a chunk of a channel, from the cache if there
+        """
+        key = (channel, chunk)
+        if key in self.cache:
+            self.cache.move_to_end(key)
+            return self.cache[key]
+        if data is None:
+            data = self.decompress_chunk(channel, chunk)
+        self.cache[key] = data
+        while len(self.cache) > self.cache_chunks:
+            self.cache.popitem(last = False)  # least recently used first
+        return data
+
+    def read_raw(self, first_sample, last_sample, indices, out):
+        """
+        Copies the int16 samples [first_sample, last_sample) of the channels in indices into out.
+        """
+        if not self.compressed:
+            columns = self.get_columns()
+            for row, j in enumerate(indices):
+                out[row] = columns[j][first_sample:last_sample]
+            return
+        first_chunk = first_sample // self.chunk_size
+        last_chunk = -(-last_sample // self.chunk_size)
+        spans = [(row, j, chunk) for row, j in enumerate(indices) for chunk in range(first_chunk, last_chunk)]
+
+        def copy_chunk(span, data = None):
+            row, j, chunk = span
+            if data is None:
+                data = self.decompress_chunk(j, chunk)
+            start = max(first_sample, chunk * self.chunk_size)
+            stop = min(last_sample, (chunk + 1) * self.chunk_size)
+            out[row, start - first_sample:stop - first_sample] = data[start - chunk * self.chunk_size:
+                                                                      stop - chunk * self.chunk_size]
+
+        if len(spans) > self.cache_chunks:
+            # caching would only evict the chunks sequential reads are using, so
+            # each chunk not cached already is decompressed into out and dropped
+            missing = [span for span in spans if span[1:] not in self.cache]
+            for span in spans:
+                if span[1:] in self.cache:
+                    copy_chunk(span, self.cache[span[1:]])
+            list(self.get_pool().map(copy_chunk, missing))
+            return
+        # mark the cached chunks used first, so adding the missing ones can't evict them
+        missing = []
+        for span in spans:
+            if span[1:] in self.cache:
+                self.cache.move_to_end(span[1:])
+            else:
+                missing.append(span[1:])
+        if len(missing) > 1:
+            for key, data in zip(missing, self.get_pool().map(lambda key: self.decompress_chunk(*key), missing)):
+                self.read_chunk(key[0], key[1], data)
+        for span in spans:
+            copy_chunk(span, self.read_chunk(span[1], span[2]))
+
+    @instrument.timed('decode')
+    def read_samples(self, first_sample, last_sample, out = None, dtype = np.float64, channels = None):
+        """
+        Decodes samples [first_sample, last_sample) of the selected channels, see HekaReader.read_samples.
+        """
+        indices = self.get_channel_indices(channels)
+        first_sample, last_sample = self.clip_sample_range(first_sample, last_sample)
+        if out is None:
+            out = np.empty((len(indices), last_sample - first_sample), dtype=dtype)
+        raw = np.empty((len(indices), last_sample - first_sample), dtype=np.int16) \
+            if np.dtype(dtype) != np.int16 else out
+        self.read_raw(first_sample, last_sample, indices, raw)
+        first_block, last_block = self.get_sample_block_range(first_sample, last_sample)
+        scales = self.get_block_scales()[first_block:last_block]
+        instrument.count('decode', bytes = raw.nbytes, blocks = last_block - first_block)
+        if np.dtype(dtype) == np.int16:
+            offset = first_sample - first_block * self.block_size
+            return self.key_by_channel([heka.ScaledSamples(out[row], scales[:, j], offset, self.block_size)
+                                        for row, j in enumerate(indices)], channels)
+        position = 0
+        for piece_first, piece_last, start, stop in self.get_block_pieces(first_sample, last_sample):
+            n_blocks = piece_last - piece_first
+            length = n_blocks * (stop - start)
+            target = out[:, position:position + length].reshape(len(indices), n_blocks, stop - start)
+            source = raw[:, position:position + length].reshape(len(indices), n_blocks, stop - start)
+            for row, j in enumerate(indices):
+                np.multiply(source[row], scales[piece_first - first_block:piece_last - first_block, j, np.newaxis],
+                            out=target[row])
+            position += length
+        return self.key_by_channel(out, channels)
+
+    def get_next_blocks(self, n_blocks=1, dtype=np.float64, channels=None):
+        """
+        Get the next n blocks of data, see HekaReader.get_next_blocks.
+        """
+        first_block = self.next_block
+        last_block = min(first_block + n_blocks, self.num_blocks_in_file)
+        if last_block <= first_block:
+            if channels is not None:
+                return self.key_by_channel([np.empty(0) for j in self.get_channel_indices(channels)], channels)
+            return [np.empty(0)]
+        self.next_block = last_block
+        data = self.get_scaled_blocks(first_block, last_block, dtype = dtype, channels = channels)
+        return data if channels is not None else list(data)
@@ -0,0 +1,249 @@
+#!/usr/bin/env python
+
+"""
+Detect translocation events in .hkd recordings, chunk by chunk
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+import numpy as np
+
+from . import heka_reader as heka
+from . import instrument
+
+# start, end and dwell_time in s; delta_i and baseline in A; delta_g in S; voltage in V
+EVENT_DTYPE = np.dtype([('start', np.float64), ('end', np.float64), ('dwell_time', np.float64),
+                        ('delta_i', np.float64), ('delta_g', np.float64), ('baseline', np.float64),
+                        ('voltage', np.float64)])
+
+def window_baseline(data, window):
+    """Median and MAD based standard deviation of consecutive windows of data
+
+    :param data: 1D numpy array
+    :param window: Number of samples per window, the last window may be shorter
+    :returns: [medians, stds, lengths] of the windows
+
+    """
+    full = len(data)//window
+    medians = []
+    stds = []
+    if full > 0:
+        windows = data[:full*window].reshape(full, window)
+        median = np.median(windows, axis = 1)
+        medians.append(median)
+        stds.append(1.4826*np.median(np.abs(windows - median[:, np.newaxis]), axis = 1))
+    if len(data) > full*window:
+        tail = data[full*window:]
+        median = np.median(tail)
+        medians.append([median])
+        stds.append([1.4826*np.median(np.abs(tail - median))])
+    lengths = np.full(full + (len(data) > full*window), window)
+    if len(data) > full*window:
+        lengths[-1] = len(data) - full*window
+    return [np.concatenate(medians), np.concatenate(stds), lengths]
+
+class EventDetector:
+    """Threshold event detector that keeps its state between chunks
+
+    The baseline and noise level are the median and MAD of windows of
+    baseline_window s, smoothed from window to window so they follow slow
+    drift. An event is a run of samples deviating from the baseline towards
+    zero current (a blockade) by more than end_threshold noise levels that
+    reaches threshold noise levels at least once, so an event starts at the
+    larger threshold and ends at the smaller one. Events still open at the
+    end of a chunk are continued in the next one. A voltage step ends any
+    open event and restarts the baseline estimate.
+
+    """
+    def __init__(self, fs, threshold = 5.0, end_threshold = 1.0, baseline_window = 0.1, smoothing = 0.1,
+                 min_duration = 0, offset = 0):
+        """
+        :param fs: Sample rate in Hz
+        :param threshold: Deviation, in noise levels, that starts an event (Default = 5)
+        :param end_threshold: Deviation, in noise levels, below which an event ends (Default = 1)
+        :param baseline_window: Length in s of the windows the baseline is estimated over (Default = 0.1)
+        :param smoothing: Weight of a new window in the baseline, 1 uses each window as is (Default = 0.1)
+        :param min_duration: Events shorter than this many s are dropped (Default = 0)
+        :param offset: Index of the first sample that will be processed (Default = 0)
+        """
+        self.fs = fs
+        self.threshold = threshold
+        self.end_threshold = end_threshold
+        self.window = max(1, int(baseline_window*fs))
+        self.smoothing = smoothing
+        self.min_samples = int(min_duration*fs)
+        self.position = offset
+        self.baseline = None
+        self.std = None
+        self.voltage = None
+        # open event: [start index, sum of deviations, number of samples, reached threshold, baseline, voltage]
+        self.open_event = None
+
+    def smooth(self, values, previous):
+        """Exponentially smooth per window values, continuing from the previous chunk"""
+        from scipy import signal
+        previous = values[0] if previous is None else previous
+        smoothed, _ = signal.lfilter([self.smoothing], [1, self.smoothing - 1], values,
+                                     zi = [(1 - self.smoothing)*previous])
+        return smoothed
+
+    def process(self, current, voltage):
+        """Detect events in the next chunk of the trace
+
+        :param current: 1D numpy array of current in A following the previous chunk
+        :param voltage: 1D numpy array of the voltage in V of the same samples
+        :returns: List of events finished in this chunk, as tuples of the EVENT_DTYPE fields
+
+        """
+        events = []
+        steps = np.flatnonzero(np.diff(voltage)) + 1
+        for first, last in zip(np.concatenate(([0], steps)), np.concatenate((steps, [len(current)]))):
+            if voltage[first] != self.voltage:
+                events.extend(self.finish())
+                self.baseline, self.std, self.voltage = None, None, voltage[first]
+            events.extend(self.process_plateau(current[first:last], voltage[first]))
+        return events
+
+    def process_plateau(self, current, voltage):
+        """Detect events in a part of the next chunk at constant voltage, see process"""
+        n = len(current)
+        if n == 0:
+            return []
+        medians, stds, lengths = window_baseline(current, self.window)
+        baselines = self.smooth(medians, self.baseline)
+        noise = self.smooth(stds, self.std)
+        self.baseline, self.std = baselines[-1], noise[-1]
+        baseline = np.repeat(baselines, lengths)
+        noise = np.repeat(noise, lengths)
+
+        # deviation towards zero current, positive for blockades of either polarity
+        deviation = np.where(baseline < 0, current - baseline, baseline - current)
+        active = deviation > self.end_threshold*noise
+        reached = deviation > self.threshold*noise
+
+        edges = np.diff(np.concatenate(([0], active.astype(np.int8), [0])))
+        starts = np.flatnonzero(edges == 1)
+        ends = np.flatnonzero(edges == -1)
+        sums = np.concatenate(([0], np.cumsum(np.where(active, deviation, 0))))
+        reached_counts = np.concatenate(([0], np.cumsum(reached)))
+
+        events = []
+        if self.open_event is not None:
+            if len(starts) > 0 and starts[0] == 0:  # the open event continues into this chunk
+                end = ends[0]
+                self.open_event[1] += sums[end]
+                self.open_event[2] += end
+                self.open_event[3] = self.open_event[3] or reached_counts[end] > 0
+                starts, ends = starts[1:], ends[1:]
+                if end < n:
+                    events.extend(self.close_event(self.position + end))
+            else:
+                events.extend(self.close_event(self.position))
+
+        for start, end in zip(starts, ends):
+            event = [self.position + start, sums[end] - sums[start], end - start,
+                     reached_counts[end] > reached_counts[start], baseline[start], voltage]
+            self.open_event = event
+            if end < n:  # otherwise carried over to the next chunk
+                events.extend(self.close_event(self.position + end))
+        self.position += n
+        return events
+
+    def close_event(self, end):
+        """Finish the open event at sample end, returning it if it is a real event"""
+        start, deviation_sum, count, reached, baseline, voltage = self.open_event
+        self.open_event = None
+        if not reached or count < max(1, self.min_samples):
+            return []
+        delta_i = deviation_sum/count
+        delta_g = delta_i/abs(voltage) if voltage != 0 else np.nan
+        return [(start/self.fs, end/self.fs, (end - start)/self.fs, delta_i, delta_g, baseline, voltage)]
+
+    def finish(self):
+        """Close an event still open at the end of the trace
+
+        :returns: List with the last event, if any
+
+        """
+        if self.open_event is None:
+            return []
+        return self.close_event(self.position)
+
+@instrument.timed('event detection')
+def detect_range(fname, first_sample, last_sample, keep = None, channel = 0, chunk_size = 2**20, **options):
+    """Detect events in samples [first_sample, last_sample) of a file
+
+    :param fname: Filename of .hkd file to be processed
+    :param keep: Only return events starting in this [first, last) sample range (Default = all)
+    :param channel: Index of the channel to analyse (Default = 0)
+    :param chunk_size: Samples decoded at once (Default = 2**20)
+    :param options: EventDetector keyword arguments
+    :returns: Numpy array of EVENT_DTYPE
+
+    """
+    reader = heka.HekaReader(fname, prefetch = 2)  # read ahead while a chunk is analysed
+    fs = reader.get_sample_rate()
+    detector = EventDetector(fs, offset = first_sample, **options)
+    events = []
+    name = reader.get_channel_names(channel)[0]
+    for offset, current, voltage in reader.iter_chunks(chunk_size, 0, first_sample, last_sample, channels = channel):
+        events.extend(detector.process(current[name], voltage[name]))
+    events.extend(detector.finish())
+    reader.close_file()
+    events = np.array(events, dtype = EVENT_DTYPE)
+    if keep is not None:
+        starts = np.round(events['start']*fs)
+        events = events[(starts >= keep[0]) & (starts < keep[1])]
+    return events
+
+def detect_events(fname, start = 0, stop = 0, processes = 1, overlap = 1.0, channel = 0, chunk_size = 2**20,
+                  output = None, **options):
+    """Detect translocation events in a .hkd file
+
+    With several processes the window is split into one range per process.
+    Each worker also reads overlap s on both sides of its range, to settle the
+    baseline before it and to finish events running past it, and keeps only
+    the events starting inside its range.
+
+    :param fname: Filename of .hkd file to be processed
+    :param start: Start of the window in s (Default = 0)
+    :param stop: End of the window in s, 0 reads to the end of the file (Default = 0)
+    :param processes: Number of worker processes (Default = 1)
+    :param overlap: Time in s read on both sides of each range (Default = 1)
+    :param channel: Index of the channel to analyse (Default = 0)
+    :param chunk_size: Samples decoded at once (Default = 2**20)
+    :param output: Filename of a .csv event table to write (Default = None)
+    :param options: EventDetector keyword arguments, eg threshold, end_threshold, baseline_window
+    :returns: Numpy array of EVENT_DTYPE, one entry per event in time order
+
+    """
+    reader = heka.HekaReader(fname)
+    fs = reader.get_sample_rate()
+    first_sample, last_sample = reader.get_sample_range(start, stop)
+    reader.close_file()
+
+    detect = partial(detect_range, fname, channel = channel, chunk_size = chunk_size, **options)
+    if processes == 1:
+        events = detect(first_sample, last_sample)
+    else:
+        bounds = np.linspace(first_sample, last_sample, processes + 1).astype(np.int64)
+        margin = int(overlap*fs)
+        ranges = [[max(first_sample, a - margin), min(last_sample, b + margin), [a, b]]
+                  for a, b in zip(bounds[:-1], bounds[1:]) if b > a]
+        with ProcessPoolExecutor(max_workers = processes) as pool:
+            parts = list(pool.map(detect, *zip(*ranges)))
+        events = np.concatenate(parts) if parts else np.empty(0, dtype = EVENT_DTYPE)
+    if output is not None:
+        write_events(events, output)
+    return events
+
+def write_events(events, fname):
+    """Save an event table as .csv
+
+    :param events: Numpy array of EVENT_DTYPE
+    :param fname: Filename of the .csv file
+
+    """
+    np.savetxt(fname, events.view(np.float64).reshape(len(events), -1), delimiter = ",",
+               header = ",".join(EVENT_DTYPE.names), comments = "")
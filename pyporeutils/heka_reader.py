@@ -0,0 +1,1260 @@
+import numpy as np
+import os
+import queue
+import tempfile
+import threading
+
+from . import instrument
+
+# Data types list, in order specified by the HEKA file header v2.0.
+# Using big-endian.
+# Code 0=uint8,1=uint16,2=uint32,3=int8,4=int16,5=int32,
+#    6=single,7=double,8=string64,9=string512
+ENCODINGS = [np.dtype('>u1'), np.dtype('>u2'), np.dtype('>u4'),
+             np.dtype('>i1'), np.dtype('>i2'), np.dtype('>i4'),
+             np.dtype('>f4'), np.dtype('>f8'), np.dtype('>S64'),
+             np.dtype('>S512'), np.dtype('<u2')]
+
+def get_param_list_byte_length(param_list):
+    """
+    Returns the length in bytes of the sum of all the parameters in the list.
+    Here, list[i][0] = param, list[i][1] = np.dtype
+    """
+    size = 0
+    for i in param_list:
+        size += i[1].itemsize
+    return size
+
+def get_param_list_dtype(param_list):
+    """
+    Returns a structured numpy dtype with one field per parameter in the list,
+    in file order. Field names are the decoded parameter names.
+    Here, list[i][0] = param, list[i][1] = np.dtype
+    """
+    return np.dtype([(i[0].decode('utf-8'), i[1]) for i in param_list])
+
+def parse_param_list(header, offset, name_dtype):
+    """
+    Decodes a binary parameter list at offset in header: 3 null bytes, a uint8
+    count, then per parameter a uint8 type code and a name of type name_dtype.
+    :returns: [param_list, end], param_list as from HekaReader.read_heka_header_param_list
+        and end the offset following the list, or None if header ends before the list does
+    """
+    if len(header) < offset + 4:
+        return None
+    count = header[offset + 3]
+    entries_dtype = np.dtype([('code', '>u1'), ('name', name_dtype)])
+    end = offset + 4 + count * entries_dtype.itemsize
+    if len(header) < end:
+        return None
+    entries = np.frombuffer(header, entries_dtype, count, offset + 4)
+    return [[[name.strip(), ENCODINGS[code]] for code, name in zip(entries['code'], entries['name'])], end]
+
+def parse_header(header):
+    """
+    Decodes the header of a .hkd file from its first bytes, read in one go:
+    the text header, the four parameter lists and the per file parameters.
+    :param header: Bytes from the start of the file
+    :returns: Dict with per_file_param_list, per_block_param_list,
+        per_channel_param_list, channel_list, per_file_params and header_length,
+        or None if header ends before the per file parameters do
+    """
+    first_line_end = header.find(b'\n')
+    first_line = header if first_line_end < 0 else header[:first_line_end]
+    if not bytes('Nanopore Experiment Data File V2.0', 'utf-8') in first_line:
+        if first_line_end < 0 and len(header) < 64:  # first line not complete yet
+            return None
+        raise IOError('Heka data file format not recognized.')
+    end_of_text = header.find(bytes('End of file format', 'utf-8'))
+    if end_of_text < 0 or header.find(b'\n', end_of_text) < 0:
+        return None
+    offset = header.find(b'\n', end_of_text) + 1
+    parsed = {}
+    for key, name_dtype in [['per_file_param_list', np.dtype('>S64')], ['per_block_param_list', np.dtype('>S64')],
+                            ['per_channel_param_list', np.dtype('>S64')], ['channel_list', np.dtype('>S512')]]:
+        param_list = parse_param_list(header, offset, name_dtype)
+        if param_list is None:
+            return None
+        parsed[key], offset = param_list
+    params_dtype = np.dtype([('f%d' % i, dtype) for i, (name, dtype) in enumerate(parsed['per_file_param_list'])])
+    if len(header) < offset + params_dtype.itemsize:
+        return None
+    values = np.frombuffer(header, params_dtype, 1, offset)[0]
+    parsed['per_file_params'] = dict((name, values[i]) for i, (name, dtype) in enumerate(parsed['per_file_param_list']))
+    parsed['header_length'] = offset + params_dtype.itemsize
+    return parsed
+
+def read_header(heka_file, read_size = 2**14):
+    """
+    Reads the header of an open .hkd file with as few reads as possible,
+    leaving the file positioned at the first block.
+    :param heka_file: File opened in binary mode, positioned at its start
+    :param read_size: Bytes read at first, doubled until the header fits (Default = 2**14)
+    :returns: Dict of header fields, see parse_header
+    """
+    header = heka_file.read(read_size)
+    while True:
+        parsed = parse_header(header)
+        if parsed is not None:
+            heka_file.seek(parsed['header_length'])
+            return parsed
+        more = heka_file.read(len(header))
+        if not more:
+            raise IOError('Heka file ends within its header.')
+        header += more
+
+def decimate_envelope(data, factor, mean = False):
+    """
+    Reduces data to min/max envelopes over consecutive bins of factor samples
+    using reshape based reductions. A trailing partial bin is reduced on its own.
+    :param data: 2D numpy array of shape (channels, points)
+    :param factor: Number of samples per bin
+    :param mean: Also compute the mean of each bin (Default = False)
+    :returns: [maxima, minima, means], each of shape (channels, bins); means is None unless requested
+    """
+    channels, points = data.shape
+    full_bins = points // factor
+    n_bins = -(-points // factor)
+    maxima = np.empty((channels, n_bins))
+    minima = np.empty((channels, n_bins))
+    means = np.empty((channels, n_bins)) if mean else None
+    if full_bins > 0:
+        bins = data[:, :full_bins * factor].reshape(channels, full_bins, factor)
+        bins.max(axis=2, out=maxima[:, :full_bins])
+        bins.min(axis=2, out=minima[:, :full_bins])
+        if mean:
+            bins.mean(axis=2, out=means[:, :full_bins])
+    if n_bins > full_bins:
+        tail = data[:, full_bins * factor:]
+        maxima[:, -1] = tail.max(axis=1)
+        minima[:, -1] = tail.min(axis=1)
+        if mean:
+            means[:, -1] = tail.mean(axis=1)
+    return [maxima, minima, means]
+
+def get_envelope_dtype(dtype):
+    """
+    :returns: Floating point type to store reductions of samples requested as dtype.
+    """
+    return np.dtype(np.float64) if np.dtype(dtype) == np.int16 else np.dtype(dtype)
+
+class VoltageSteps:
+    """
+    Piecewise constant voltage trace stored as run-length steps instead of one
+    value per sample. Step k holds values[k] for samples [starts[k], starts[k + 1]),
+    the last step runs to the end of the trace.
+    Indexing with an int or slice expands only the requested samples,
+    np.asarray(steps) expands the whole trace.
+    """
+    def __init__(self, starts, values, length):
+        self.starts = np.asarray(starts, dtype=np.int64)
+        self.values = np.asarray(values, dtype=np.float64)
+        self.length = int(length)
+
+    @classmethod
+    def from_blocks(cls, block_voltages, samples_per_block):
+        """
+        Builds the steps from one voltage per block, merging equal neighbours.
+        :param block_voltages: 1D array of the voltage of each block
+        :param samples_per_block: Number of samples each block voltage spans
+        """
+        block_voltages = np.asarray(block_voltages, dtype=np.float64)
+        first_blocks = np.flatnonzero(np.diff(block_voltages) != 0) + 1
+        first_blocks = np.concatenate(([0], first_blocks)) if block_voltages.size else first_blocks
+        return cls(first_blocks * samples_per_block, block_voltages[first_blocks],
+                   block_voltages.size * samples_per_block)
+
+    def __len__(self):
+        return self.length
+
+    def __array__(self, dtype=None):
+        values = self.expand()
+        return values if dtype is None else values.astype(dtype)
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            first, last, step = key.indices(self.length)
+            if step == 1:
+                return self.expand(first, last)
+            return self.expand()[key]
+        if isinstance(key, (int, np.integer)):
+            index = key + self.length if key < 0 else key
+            if not 0 <= index < self.length:
+                raise IndexError('index %d is out of bounds for length %d' % (key, self.length))
+            return self.values[np.searchsorted(self.starts, index, side='right') - 1]
+        key = np.asarray(key)
+        if key.dtype.kind in 'iu':
+            indices = np.where(key < 0, key + self.length, key)
+            if np.any((indices < 0) | (indices >= self.length)):
+                raise IndexError('index out of bounds for length %d' % self.length)
+            return self.values[np.searchsorted(self.starts, indices, side='right') - 1]
+        return self.expand()[key]
+
+    def expand(self, first = 0, last = None):
+        """
+        :returns: Voltage of every sample in [first, last) as a float64 numpy array.
+        """
+        last = self.length if last is None else last
+        if last <= first:
+            return np.empty(0)
+        first_step = np.searchsorted(self.starts, first, side='right') - 1
+        last_step = np.searchsorted(self.starts, last, side='left')
+        bounds = np.clip(np.append(self.starts[first_step:last_step], self.length), first, last)
+        bounds[-1] = last
+        return np.repeat(self.values[first_step:last_step], np.diff(bounds))
+
+class ScaledSamples:
+    """
+    Raw int16 samples of one channel kept with the scale of each block they
+    come from, a quarter of the memory of float64 data. Samples are scaled to
+    floating point only when indexed, sliced or passed to np.asarray.
+    Sample k comes from block (offset + k) // block_size of scales.
+    """
+    def __init__(self, raw, scales, offset, block_size):
+        self.raw = raw
+        self.scales = np.asarray(scales, dtype=np.float64)
+        self.offset = int(offset)
+        self.block_size = int(block_size)
+
+    def __len__(self):
+        return len(self.raw)
+
+    @property
+    def shape(self):
+        return self.raw.shape
+
+    @property
+    def nbytes(self):
+        return self.raw.nbytes + self.scales.nbytes
+
+    def __array__(self, dtype=None):
+        values = self.scaled()
+        return values if dtype is None else values.astype(dtype)
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            first, last, step = key.indices(len(self))
+            if step == 1:
+                return self.scaled(first, last)
+            return self.scaled()[key]
+        if isinstance(key, (int, np.integer)):
+            index = key + len(self) if key < 0 else key
+            if not 0 <= index < len(self):
+                raise IndexError('index %d is out of bounds for length %d' % (key, len(self)))
+            return self.raw[index] * self.scales[(self.offset + index) // self.block_size]
+        key = np.asarray(key)
+        if key.dtype.kind in 'iu':
+            indices = np.where(key < 0, key + len(self), key)
+            return self.raw[indices] * self.scales[(self.offset + indices) // self.block_size]
+        return self.scaled()[key]
+
+    def scaled(self, first = 0, last = None, dtype = np.float64):
+        """
+        Scales samples [first, last). The product is formed in float64 and then
+        stored as dtype, so float32 output only differs by its rounding.
+        :returns: 1D numpy array of dtype.
+        """
+        last = len(self) if last is None else last
+        if last <= first:
+            return np.empty(0, dtype=dtype)
+        first_block = (self.offset + first) // self.block_size
+        last_block = -(-(self.offset + last) // self.block_size)
+        bounds = np.clip(np.arange(first_block, last_block + 1) * self.block_size - self.offset, first, last)
+        scales = np.repeat(self.scales[first_block:last_block], np.diff(bounds))
+        return np.multiply(self.raw[first:last], scales, out=np.empty(last - first, dtype=dtype))
+
+class SampleArray:
+    """
+    Array-like view of the scaled samples of a reader, shape (channels, points).
+    Indexing decodes only the blocks holding the requested samples, e.g.
+    samples[0, 1000:2000], samples['Current', -500:] or samples[:, ::10];
+    np.asarray(samples) decodes the whole recording.
+    """
+    def __init__(self, reader, dtype = np.float64):
+        self.reader = reader
+        self.dtype = np.dtype(dtype)
+
+    @property
+    def shape(self):
+        return (self.reader.channel_list_number, self.reader.points_per_channel_total)
+
+    @property
+    def ndim(self):
+        return 2
+
+    def __len__(self):
+        return self.reader.channel_list_number
+
+    def __array__(self, dtype=None):
+        values = self[:, :]
+        return values if dtype is None else values.astype(dtype)
+
+    def __getitem__(self, key):
+        if not isinstance(key, tuple):
+            key = (key,)
+        if len(key) > 2:
+            raise IndexError('too many indices for an array of 2 dimensions')
+        channel_key, sample_key = key if len(key) == 2 else (key[0], slice(None))
+        if isinstance(channel_key, (str, bytes)):
+            channel_key = self.reader.get_channel_indices(channel_key)[0]
+        channels = np.arange(self.reader.channel_list_number)[channel_key]
+
+        length = self.reader.points_per_channel_total
+        if isinstance(sample_key, slice):
+            first, last, step = sample_key.indices(length)
+            indices = None if step == 1 else np.arange(first, last, step)
+        elif isinstance(sample_key, (int, np.integer)):
+            index = sample_key + length if sample_key < 0 else sample_key
+            if not 0 <= index < length:
+                raise IndexError('index %d is out of bounds for length %d' % (sample_key, length))
+            indices = index
+        else:
+            indices = np.asarray(sample_key)
+            if indices.dtype.kind not in 'iu':
+                raise IndexError('samples can only be indexed with ints, slices or integer arrays')
+            indices = np.where(indices < 0, indices + length, indices)
+            if np.any((indices < 0) | (indices >= length)):
+                raise IndexError('index out of bounds for length %d' % length)
+        channel_list = list(np.atleast_1d(channels))
+        if indices is None:
+            out = np.empty((len(channel_list), max(0, last - first)), dtype=self.dtype)
+            self.reader.read_samples(first, last, out = out, dtype = self.dtype, channels = channel_list)
+        else:
+            out = self.gather(np.asarray(indices), channel_list)
+        return out[0] if np.ndim(channels) == 0 else out
+
+    def gather(self, indices, channels, run_samples = 2**20):
+        """
+        Decodes the samples at indices, touching only the blocks that hold them:
+        runs of consecutive blocks, at most run_samples long, are decoded one at
+        a time and their samples picked out.
+        :param indices: Integer array of sample indices, already in range
+        :param channels: List of channel indices
+        :returns: Array of shape (channels,) + indices.shape
+        """
+        block_size = self.reader.block_size
+        flat = indices.ravel()
+        order = np.argsort(flat, kind='stable')
+        ordered = flat[order]
+        blocks = np.unique(ordered // block_size)
+        # split the needed blocks where they stop being consecutive or a run gets too long
+        breaks = np.flatnonzero(np.diff(blocks) != 1) + 1
+        max_blocks = max(1, run_samples // block_size)
+        out = np.empty((len(channels), len(flat)), dtype=self.dtype)
+        for run in np.split(blocks, breaks) if len(blocks) else []:
+            for first_block in run[::max_blocks]:
+                last_block = min(first_block + max_blocks, run[-1] + 1)
+                first = int(first_block) * block_size
+                last = min(int(last_block) * block_size, self.reader.points_per_channel_total)
+                values = np.empty((len(channels), last - first), dtype=self.dtype)
+                self.reader.read_samples(first, last, out = values, dtype = self.dtype, channels = channels)
+                lo, hi = np.searchsorted(ordered, [first, last])
+                out[:, order[lo:hi]] = values[:, ordered[lo:hi] - first]
+        return out.reshape((len(channels),) + indices.shape)
+
+class ChunkPrefetcher:
+    """
+    Decodes chunks for HekaReader.iter_chunks in a background thread, up to
+    depth chunks ahead of the consumer, so that reading the file overlaps with
+    the work done on each chunk. The chunks are decoded into a ring of
+    depth + 1 preallocated buffers; a buffer is reused once the consumer asks
+    for the chunk after it.
+    """
+    def __init__(self, reader, bounds, depth, n_channels, samples, dtype = np.float64, channels = None):
+        """
+        :param reader: HekaReader to read from
+        :param bounds: List of [first_sample, last_sample] of the chunks, in order
+        :param depth: Number of chunks decoded ahead of the consumer, at least 1
+        :param n_channels: Number of channels decoded
+        :param samples: Largest number of samples in a chunk
+        :param dtype: Type of the current, see HekaReader.read_samples (Default = np.float64)
+        :param channels: Channel selection, see HekaReader.read_samples (Default = all channels)
+        """
+        self.reader = reader
+        self.bounds = bounds
+        self.dtype = dtype
+        self.channels = channels
+        self.free = queue.Queue()
+        self.ready = queue.Queue()
+        for _ in range(depth + 1):
+            self.free.put([np.empty((n_channels, samples), dtype=dtype), np.empty((n_channels, samples))])
+        self.stopping = threading.Event()
+        self.thread = threading.Thread(target=self.run, name='heka-prefetch', daemon=True)
+        self.thread.start()
+
+    def run(self):
+        try:
+            for first_sample, last_sample in self.bounds:
+                buffers = self.get_free_buffers()
+                if buffers is None:
+                    return
+                current, voltage = buffers
+                length = last_sample - first_sample
+                chunk = self.reader.read_samples(first_sample, last_sample, out = current[:, :length],
+                                                 dtype = self.dtype, channels = self.channels)
+                voltages = self.reader.read_voltage_samples(first_sample, last_sample, out = voltage[:, :length],
+                                                            channels = self.channels)
+                self.ready.put([first_sample, chunk, voltages, buffers])
+        except Exception as e:  # handed to the consumer
+            self.ready.put(e)
+        finally:
+            self.ready.put(None)
+
+    def get_free_buffers(self):
+        """
+        :returns: Buffers free for the next chunk, or None once stopped
+        """
+        while not self.stopping.is_set():
+            try:
+                return self.free.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        return None
+
+    def __iter__(self):
+        """
+        :returns: Generator of [offset, current, voltage], as HekaReader.iter_chunks
+        """
+        try:
+            while True:
+                item = self.ready.get()
+                if item is None:
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                offset, chunk, voltages, buffers = item
+                yield [offset, chunk, voltages]
+                self.free.put(buffers)
+        finally:
+            self.close()
+
+    def close(self):
+        """Stops the background thread and waits for it"""
+        self.stopping.set()
+        self.thread.join()
+        self.reader.prefetchers.discard(self)
+
+class HekaReader:
+    @instrument.timed('header')
+    def __init__(self, filename, use_index = False, prefetch = 0):
+        """
+        :param filename: Path of the .hkd file
+        :param use_index: Keep per block headers and statistics in a sidecar
+            index file next to the data, built on first use and reused while the
+            data file is unchanged. 'if-valid' uses the index only if a valid one
+            exists already, never building one (Default = False)
+        :param prefetch: Number of chunks iter_chunks decodes ahead in a background
+            thread, 0 reading synchronously (Default = 0)
+        """
+        self.filename = filename
+        self.prefetch = prefetch
+        self.prefetchers = set()
+        self.heka_file = open(filename, 'rb')
+        # Text header, binary parameter lists and per file parameters, decoded
+        # from one read; heka_file is left at the binary data.
+        try:
+            header = read_header(self.heka_file)
+        except IOError:
+            self.heka_file.close()
+            raise
+        self.per_file_param_list = header['per_file_param_list']
+        self.per_block_param_list = header['per_block_param_list']
+        self.per_channel_param_list = header['per_channel_param_list']
+        self.channel_list = header['channel_list']
+        self.per_file_params = header['per_file_params']
+
+        # # Calculate sizes of blocks, channels, etc
+        self.per_file_header_length = header['header_length']
+
+        # Calculate the block lengths
+        self.per_channel_per_block_length = get_param_list_byte_length(self.per_channel_param_list)
+        self.per_block_length = get_param_list_byte_length(self.per_block_param_list)
+
+        self.channel_list_number = len(self.channel_list)
+
+        self.header_bytes_per_block = self.per_channel_per_block_length * self.channel_list_number
+        self.data_bytes_per_block = self.per_file_params[bytes('Points per block', 'utf-8')] * 2 * self.channel_list_number
+        self.total_bytes_per_block = self.header_bytes_per_block + self.data_bytes_per_block + self.per_block_length
+
+        # Calculate number of points per channel
+        self.file_size = os.path.getsize(filename)
+        self.num_blocks_in_file = int((self.file_size - self.per_file_header_length) / self.total_bytes_per_block)
+        remainder = (self.file_size - self.per_file_header_length) % self.total_bytes_per_block
+        if not remainder == 0:
+            self.heka_file.close()
+            raise IOError('Heka file ends with incomplete block')
+        self.block_size = int(self.per_file_params[bytes('Points per block', 'utf-8')])
+        self.points_per_channel_total = self.block_size * self.num_blocks_in_file
+
+        self.sample_rate = 1.0 / self.per_file_params[bytes('Sampling interval', 'utf-8')]
+
+        # Record layout of one block: block header, per channel headers, then
+        # the int16 samples of each channel back to back.
+        self.block_dtype = np.dtype([
+            ('block', get_param_list_dtype(self.per_block_param_list)),
+            ('channel', get_param_list_dtype(self.per_channel_param_list), (self.channel_list_number,)),
+            ('data', np.dtype('>i2'), (self.channel_list_number, self.block_size))])
+        self.block_records = None
+        self.block_headers = None
+
+        self.index_filename = filename + '.idx.npz'
+        self.index = self.load_index() if use_index else None
+        self.use_index = self.index is not None if use_index == 'if-valid' else bool(use_index)
+
+    def close_file(self):
+        # stop background reads before the file goes away
+        for prefetcher in list(self.prefetchers):
+            prefetcher.close()
+        self.heka_file.close()
+        # drop the memory map so the underlying file handle is released
+        self.block_records = None
+        self.block_headers = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close_file()
+        return False
+
+    def __len__(self):
+        return self.points_per_channel_total
+
+    def __getitem__(self, key):
+        """
+        reader[i0:i1] decodes samples i0 to i1 of every channel, touching only
+        the blocks that hold them; same as reader.samples[:, i0:i1].
+        """
+        return self.samples[:, key]
+
+    @property
+    def samples(self):
+        """
+        :returns: SampleArray of the scaled samples of every channel, shape (channels, points)
+        """
+        return SampleArray(self)
+
+    def time_slice(self, start = 0, stop = 0, channels = None):
+        """
+        Decodes a time window, touching only the blocks that hold it.
+        :param start: Start of the window in seconds (Default = 0)
+        :param stop: End of the window in seconds, 0 reads to the end of the file (Default = 0)
+        :param channels: Channel indices or names, see read_samples (Default = all channels)
+        :returns: [t, current, voltage], t being the time of each sample in seconds from
+            the start of the file and current/voltage as from read_samples and read_voltage_samples
+        """
+        first_sample, last_sample = self.get_sample_range(start, stop)
+        t = np.arange(first_sample, last_sample) / self.sample_rate
+        return [t, self.read_samples(first_sample, last_sample, channels = channels),
+                self.read_voltage_samples(first_sample, last_sample, channels = channels)]
+
+    def get_sample_offset(self, sample, channel = 0):
+        """
+        :param sample: Index of a sample
+        :param channel: Index or name of the channel (Default = 0)
+        :returns: Offset in bytes of the sample in the file
+        """
+        block, in_block = divmod(int(sample), self.block_size)
+        return (self.per_file_header_length + block * self.total_bytes_per_block + self.per_block_length +
+                self.header_bytes_per_block + (self.get_channel_indices(channel)[0] * self.block_size + in_block) * 2)
+
+    def get_channel_indices(self, channels = None):
+        """
+        :param channels: Channel indices, or names (str or bytes) as in channel_list,
+            a single index or name selecting one channel (Default = all channels)
+        :returns: List of channel indices
+        """
+        if channels is None:
+            return list(range(self.channel_list_number))
+        if isinstance(channels, (int, np.integer, str, bytes)):
+            channels = [channels]
+        names = [name for name, _ in self.channel_list]
+        indices = []
+        for channel in channels:
+            if isinstance(channel, str):
+                channel = bytes(channel, 'utf-8')
+            if isinstance(channel, bytes):
+                if channel not in names:
+                    raise ValueError('No channel named %s' % channel.decode('utf-8'))
+                channel = names.index(channel)
+            elif not 0 <= channel < self.channel_list_number:
+                raise IndexError('Channel %d out of range for %d channels' % (channel, self.channel_list_number))
+            indices.append(int(channel))
+        return indices
+
+    def get_channel_names(self, channels = None):
+        """
+        :param channels: Channel indices or names, see get_channel_indices (Default = all channels)
+        :returns: Decoded names of the channels from channel_list
+        """
+        return [self.channel_list[j][0].decode('utf-8') for j in self.get_channel_indices(channels)]
+
+    def key_by_channel(self, rows, channels):
+        """
+        :param rows: Results of the selected channels, one per channel
+        :param channels: Channel selection the rows were made for
+        :returns: rows unchanged if channels is None, else a dict of the rows keyed by channel name
+        """
+        if channels is None:
+            return rows
+        return dict(zip(self.get_channel_names(channels), rows))
+
+    def get_block_records(self):
+        """
+        Memory-maps the binary data of the file as an array of block records.
+        Each record has the fields 'block' (per block parameters), 'channel'
+        (per channel parameters, one entry per channel) and 'data' (raw int16
+        samples, shape (channels, points per block)).
+        :returns: Read-only numpy record array, one record per block.
+        """
+        if self.block_records is None:
+            if self.num_blocks_in_file == 0:
+                self.block_records = np.zeros(0, dtype=self.block_dtype)
+            else:
+                self.block_records = np.memmap(self.filename, dtype=self.block_dtype, mode='r',
+                                               offset=self.per_file_header_length,
+                                               shape=(self.num_blocks_in_file,))
+        return self.block_records
+
+    @instrument.timed('block headers')
+    def read_block_headers(self):
+        """
+        Reads the block and per channel parameters of every block, skipping the
+        samples between them so scans of the headers don't pull the whole file
+        into the page cache. Costs one read per block, so it only suits whole
+        file scans; windowed reads slice get_block_channel_params instead.
+        :returns: Numpy record array with the fields 'block' and 'channel' of
+            block_dtype, one record per block.
+        """
+        if self.block_headers is None:
+            header_dtype = np.dtype([(name, self.block_dtype.fields[name][0]) for name in ['block', 'channel']])
+            headers = np.zeros(self.num_blocks_in_file, dtype=header_dtype)
+            buffer = headers.view(np.uint8).reshape(-1, header_dtype.itemsize)
+            with open(self.filename, 'rb', buffering=0) as heka_file:
+                fd = heka_file.fileno()
+                if hasattr(os, 'posix_fadvise'):
+                    # no readahead: only a few hundred bytes of each block are wanted
+                    os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_RANDOM)
+                for k in range(self.num_blocks_in_file):
+                    offset = self.per_file_header_length + k * self.total_bytes_per_block
+                    if hasattr(os, 'pread'):
+                        buffer[k] = np.frombuffer(os.pread(fd, header_dtype.itemsize, offset), dtype=np.uint8)
+                    else:
+                        heka_file.seek(offset)
+                        heka_file.readinto(buffer[k])
+            instrument.count('block headers', bytes = headers.nbytes, blocks = len(headers))
+            self.block_headers = headers
+        return self.block_headers
+
+    def get_block_channel_params(self, name):
+        """
+        :param name: Name of a per channel parameter, eg 'Scale'
+        :returns: Value of the parameter in every block, shape (blocks, channels).
+            Taken from the index if enabled, else a view of the memory map.
+        """
+        if self.use_index:
+            return self.get_index()['channel.' + name]
+        return self.get_block_records()['channel'][name]
+
+    def scan_block_channel_params(self, name):
+        """
+        :param name: Name of a per channel parameter, eg 'Voltage'
+        :returns: Value of the parameter in every block, shape (blocks, channels),
+            like get_block_channel_params but read without the samples when there
+            is no index, for scans over the whole file.
+        """
+        if self.use_index:
+            return self.get_index()['channel.' + name]
+        return self.read_block_headers()['channel'][name]
+
+    def get_block_scales(self):
+        """
+        :returns: Per block 'Scale' of every channel, shape (blocks, channels).
+        """
+        return self.get_block_channel_params('Scale')
+
+    def get_block_voltages(self):
+        """
+        :returns: Per block 'Voltage' of every channel, shape (blocks, channels).
+        """
+        return self.get_block_channel_params('Voltage')
+
+    def get_block_stats(self, moments = True, channels = None):
+        """
+        Per block statistics of the scaled samples of every channel, taken from
+        the index if enabled.
+        :param moments: Also return means and sums of squares (Default = True)
+        :param channels: Channel indices or names, see get_channel_indices (Default = all channels)
+        :returns: [maxima, minima, means, sum_squares], each of shape (blocks, selected channels)
+        """
+        if self.use_index:
+            index = self.get_index()
+            indices = self.get_channel_indices(channels)
+            return [index[name][:, indices] for name in ['max', 'min', 'mean', 'sum_squares']]
+        return self.compute_block_stats(moments = moments, channels = channels)
+
+    @instrument.timed('block stats')
+    def compute_block_stats(self, chunk_blocks = 1024, moments = True, channels = None):
+        """
+        Scans the blocks chunk_blocks at a time, reducing the raw int16 samples
+        and scaling the results. Only the samples of the selected channels are read.
+        :param moments: Also compute means and sums of squares (Default = True)
+        :param channels: Channel indices or names, see get_channel_indices (Default = all channels)
+        :returns: [maxima, minima, means, sum_squares], each of shape (blocks, selected channels);
+            means and sum_squares are None without moments
+        """
+        indices = self.get_channel_indices(channels)
+        records = self.get_block_records()
+        data = records['data']
+        block_scales = records['channel']['Scale']
+        shape = (self.num_blocks_in_file, len(indices))
+        maxima, minima = np.empty(shape), np.empty(shape)
+        means, sum_squares = (np.empty(shape), np.empty(shape)) if moments else (None, None)
+        for first in range(0, self.num_blocks_in_file, chunk_blocks):
+            last = min(first + chunk_blocks, self.num_blocks_in_file)
+            for column, j in enumerate(indices):
+                raw = data[first:last, j]  # strided view of one channel
+                scales = block_scales[first:last, j].astype(np.float64)
+                raw_max = raw.max(axis=1)
+                raw_min = raw.min(axis=1)
+                # scaling is monotonic, so the extremes only swap for negative scales
+                maxima[first:last, column] = np.where(scales >= 0, raw_max * scales, raw_min * scales)
+                minima[first:last, column] = np.where(scales >= 0, raw_min * scales, raw_max * scales)
+                if not moments:
+                    continue
+                raw = raw.astype(np.float64)
+                means[first:last, column] = raw.mean(axis=1) * scales
+                sum_squares[first:last, column] = np.einsum('ij,ij->i', raw, raw) * scales**2
+        instrument.count('block stats', bytes = len(records) * len(indices) * self.block_size * 2, blocks = len(records))
+        return [maxima, minima, means, sum_squares]
+
+    def get_index_signature(self):
+        """
+        :returns: Values an index must have been built with to be valid for this file.
+        """
+        stat = os.stat(self.filename)
+        return {'file_size': stat.st_size, 'mtime_ns': stat.st_mtime_ns,
+                'header_length': self.per_file_header_length,
+                'bytes_per_block': self.total_bytes_per_block}
+
+    def load_index(self):
+        """
+        Loads the sidecar index if it exists and matches the size, modification
+        time and layout of the data file.
+        :returns: Dictionary of index arrays, or None if there is no valid index.
+        """
+        try:
+            with np.load(self.index_filename) as npz:
+                index = dict(npz)
+        except (IOError, ValueError):
+            return None
+        for key, value in self.get_index_signature().items():
+            if key not in index or index[key] != value:
+                return None
+        return index
+
+    @instrument.timed('index build')
+    def build_index(self):
+        """
+        Scans the file once and collects per block offsets, headers and
+        statistics, then saves them to the sidecar index. A data directory that
+        can't be written to just leaves the index in memory.
+        :returns: Dictionary of index arrays.
+        """
+        records = self.get_block_records()
+        index = self.get_index_signature()
+        index['offsets'] = self.per_file_header_length + \
+            np.arange(self.num_blocks_in_file, dtype=np.int64) * self.total_bytes_per_block
+        for name in records.dtype['block'].names:
+            index['block.' + name] = np.ascontiguousarray(records['block'][name])
+        for name in records.dtype['channel'].base.names:
+            index['channel.' + name] = np.ascontiguousarray(records['channel'][name])
+        index['max'], index['min'], index['mean'], index['sum_squares'] = self.compute_block_stats()
+        index = dict((key, np.asarray(value)) for key, value in index.items())
+
+        # write to a temporary file first so readers never see half an index
+        try:
+            handle, temp_name = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(self.index_filename)))
+            with os.fdopen(handle, 'wb') as temp_file:
+                np.savez(temp_file, **index)
+            os.replace(temp_name, self.index_filename)
+        except (IOError, OSError):
+            pass
+        return index
+
+    def get_index(self):
+        """
+        :returns: Dictionary of index arrays, building the index on first use.
+        """
+        if self.index is None:
+            self.index = self.load_index()
+            if self.index is None:
+                self.index = self.build_index()
+        return self.index
+
+    def get_scaled_blocks(self, first_block=0, last_block=None, dtype=np.float64, channels=None):
+        """
+        Scales the raw samples of blocks [first_block, last_block).
+        :param dtype: Output type, see read_samples (Default = np.float64)
+        :param channels: Channel indices or names, see read_samples (Default = all channels)
+        :returns: 2D numpy array of shape (channels, points), one row per channel,
+            or with channels a dict of the rows keyed by channel name.
+        """
+        last_block = self.num_blocks_in_file if last_block is None else last_block
+        return self.read_samples(first_block * self.block_size, last_block * self.block_size, dtype = dtype,
+                                 channels = channels)
+
+    def get_block_pieces(self, first_sample, last_sample):
+        """
+        Splits samples [first_sample, last_sample) into at most three pieces: a
+        partial head block, a run of whole blocks and a partial tail block.
+        :returns: List of [first_block, last_block, start, stop], the piece being
+            samples start to stop of each block in [first_block, last_block)
+        """
+        pieces = []
+        position = first_sample
+        while position < last_sample:
+            block = position // self.block_size
+            start = position - block * self.block_size
+            if start == 0 and last_sample - position >= self.block_size:
+                n_blocks = (last_sample - position) // self.block_size
+                pieces.append([block, block + n_blocks, 0, self.block_size])
+                position += n_blocks * self.block_size
+            else:
+                stop = min(self.block_size, last_sample - block * self.block_size)
+                pieces.append([block, block + 1, start, stop])
+                position += stop - start
+        return pieces
+
+    def extract_data(self, start = 0, stop = 0, decimate = False, dec_rate = 2500, dtype = np.float64, channel = 0):
+        """
+        Extracts current and voltage of one channel in a time window, decoding
+        only that channel.
+        :param start: Start of the window in seconds (Default = 0)
+        :param stop: End of the window in seconds, 0 reads to the end of the file (Default = 0)
+        :param decimate: Keep only the max and min of every dec_rate samples (Default = False)
+        :param dec_rate: Number of samples per decimation bin (Default = 2500)
+        :param dtype: Type of the current, see read_samples; decimated current is
+            never raw, so np.int16 gives float64 there (Default = np.float64)
+        :param channel: Index or name of the channel (Default = 0)
+        :returns: List of [current, time, sample rate, voltage, total length],
+            total length being the number of points the whole file has at this decimation
+        """
+        sample_rate = self.get_sample_rate()
+        first_sample, last_sample = self.get_sample_range(start, stop)
+        name = self.get_channel_names(channel)[0]
+
+        if decimate:
+            t, maxima, minima, _ = self.get_decimated_data(dec_rate, first_sample, last_sample, channels = channel)
+            # each bin contributes its max then its min at the bin start time
+            i = np.empty(2 * len(maxima[name]), dtype=get_envelope_dtype(dtype))
+            i[0::2] = maxima[name]
+            i[1::2] = minima[name]
+            bin_starts = first_sample + np.arange(len(maxima[name])) * dec_rate
+            v = np.repeat(self.get_all_voltages(channels = channel)[name][bin_starts], 2)
+            t = np.repeat(t, 2)
+            total_length = 2 * -(-self.points_per_channel_total // dec_rate)
+        else:
+            # only decode the blocks covering the requested window
+            i = self.read_samples(first_sample, last_sample, dtype = dtype, channels = channel)[name]
+            v = self.read_voltage_samples(first_sample, last_sample, channels = channel)[name]
+            t = np.arange(last_sample - first_sample) / sample_rate
+            total_length = self.points_per_channel_total
+
+        return [i, t, sample_rate, v, total_length]
+
+    @instrument.timed('decimate')
+    def get_decimated_data(self, factor, first_sample = 0, last_sample = None, mean = False, chunk_size = 2**22,
+                           channels = None):
+        """
+        Computes min/max (and optionally mean) envelopes of all channels over bins
+        of factor samples, decoding the file in chunks of about chunk_size samples.
+        Bins do not need to line up with blocks. With the index enabled, bins made
+        of whole blocks starting at a block boundary are reduced from the per block
+        statistics of the index instead, and only a trailing partial bin is decoded.
+        :param factor: Number of samples per bin
+        :param first_sample: First sample of the range to decimate (Default = 0)
+        :param last_sample: End of the range to decimate, exclusive (Default = end of file)
+        :param mean: Also compute bin means (Default = False)
+        :param chunk_size: Approximate number of samples decoded at once (Default = 2**22)
+        :param channels: Channel indices or names, see read_samples (Default = all channels)
+        :returns: [t, maxima, minima, means], t being the start time of each bin in
+            seconds from first_sample; the others have shape (channels, bins), means is None unless
+            requested; with channels maxima, minima and means are dicts of rows keyed by channel name
+        """
+        factor = int(factor)
+        if factor < 1:
+            raise ValueError('Decimation factor must be at least 1')
+        last_sample = self.points_per_channel_total if last_sample is None else last_sample
+        first_sample, last_sample = self.clip_sample_range(first_sample, last_sample)
+        chunk_size = factor * max(1, chunk_size // factor)  # chunks hold whole bins only
+
+        indices = self.get_channel_indices(channels)
+        n_bins = -(-(last_sample - first_sample) // factor)
+        maxima = np.empty((len(indices), n_bins))
+        minima = np.empty((len(indices), n_bins))
+        means = np.empty((len(indices), n_bins)) if mean else None
+        decode_start = first_sample
+        if self.use_index and factor % self.block_size == 0 and first_sample % self.block_size == 0:
+            blocks_per_bin = factor // self.block_size
+            first_block = first_sample // self.block_size
+            indexed_bins = (last_sample - first_sample) // factor
+            last_block = first_block + indexed_bins * blocks_per_bin
+            block_max, block_min, block_mean, _ = self.get_block_stats(channels = indices)
+            shape = (indexed_bins, blocks_per_bin, len(indices))
+            maxima[:, :indexed_bins] = block_max[first_block:last_block].reshape(shape).max(axis=1).T
+            minima[:, :indexed_bins] = block_min[first_block:last_block].reshape(shape).min(axis=1).T
+            if mean:
+                means[:, :indexed_bins] = block_mean[first_block:last_block].reshape(shape).mean(axis=1).T
+            decode_start = first_sample + indexed_bins * factor
+        for chunk_start in range(decode_start, last_sample, chunk_size):
+            chunk_stop = min(chunk_start + chunk_size, last_sample)
+            chunk = np.empty((len(indices), chunk_stop - chunk_start))
+            self.read_samples(chunk_start, chunk_stop, out = chunk, channels = indices)
+            envelope = decimate_envelope(chunk, factor, mean = mean)
+            first_bin = (chunk_start - first_sample) // factor
+            last_bin = first_bin + envelope[0].shape[1]
+            maxima[:, first_bin:last_bin] = envelope[0]
+            minima[:, first_bin:last_bin] = envelope[1]
+            if mean:
+                means[:, first_bin:last_bin] = envelope[2]
+
+        t = np.arange(n_bins) * factor / self.sample_rate
+        if channels is not None:
+            maxima, minima = self.key_by_channel(maxima, channels), self.key_by_channel(minima, channels)
+            means = self.key_by_channel(means, channels) if mean else None
+        return [t, maxima, minima, means]
+
+    def get_sample_range(self, start = 0, stop = 0):
+        """
+        Converts a time window into a range of sample indices.
+        :param start: Start of the window in seconds (Default = 0)
+        :param stop: End of the window in seconds, 0 reads to the end of the file (Default = 0)
+        :returns: [first_sample, last_sample], last_sample exclusive
+        """
+        first_sample = int(start*self.sample_rate)
+        last_sample = int(stop*self.sample_rate) if stop != 0 else self.points_per_channel_total
+        return self.clip_sample_range(first_sample, last_sample)
+
+    def clip_sample_range(self, first_sample, last_sample):
+        first_sample = min(max(first_sample, 0), self.points_per_channel_total)
+        last_sample = min(max(last_sample, first_sample), self.points_per_channel_total)
+        return [first_sample, last_sample]
+
+    def get_block_range(self, start = 0, stop = 0):
+        """
+        Converts a time window into the range of blocks that contain it.
+        :param start: Start of the window in seconds (Default = 0)
+        :param stop: End of the window in seconds, 0 reads to the end of the file (Default = 0)
+        :returns: [first_block, last_block], last_block exclusive
+        """
+        first_sample, last_sample = self.get_sample_range(start, stop)
+        return self.get_sample_block_range(first_sample, last_sample)
+
+    def get_sample_block_range(self, first_sample, last_sample):
+        """
+        :returns: [first_block, last_block] holding samples [first_sample, last_sample), last_block exclusive
+        """
+        first_block = first_sample // self.block_size
+        last_block = -(-last_sample // self.block_size)  # round up
+        return [first_block, max(first_block, last_block)]
+
+    @instrument.timed('decode')
+    def read_samples(self, first_sample, last_sample, out = None, dtype = np.float64, channels = None):
+        """
+        Decodes samples [first_sample, last_sample) of the selected channels,
+        touching only the blocks that hold them and, within those, only the
+        samples of the selected channels.
+        :param out: Optional array of shape (selected channels, points) and type dtype to decode into
+        :param dtype: np.float64 or np.float32 for scaled samples, or np.int16 to keep
+            the raw samples and scale them lazily (Default = np.float64)
+        :param channels: Channel indices or names, see get_channel_indices (Default = all channels)
+        :returns: 2D numpy array of shape (channels, points), one row per channel,
+            or for np.int16 a list of ScaledSamples, one for each channel. With
+            channels, a dict of the rows keyed by channel name.
+        """
+        indices = self.get_channel_indices(channels)
+        first_sample, last_sample = self.clip_sample_range(first_sample, last_sample)
+        raw = np.dtype(dtype) == np.int16
+        if out is None:
+            out = np.empty((len(indices), last_sample - first_sample), dtype=dtype)
+        records = self.get_block_records()
+        data = records['data']
+        block_scales = records['channel']['Scale']
+        position = 0
+        for first_block, last_block, start, stop in self.get_block_pieces(first_sample, last_sample):
+            n_blocks = last_block - first_block
+            length = n_blocks * (stop - start)
+            target = out[:, position:position + length].reshape(len(indices), n_blocks, stop - start)
+            for row, j in enumerate(indices):
+                # strided view of one channel, the samples of the others are not read
+                source = data[first_block:last_block, j, start:stop]
+                if raw:
+                    target[row] = source
+                else:
+                    np.multiply(source, block_scales[first_block:last_block, j, np.newaxis], out=target[row])
+            position += length
+        if instrument.is_enabled():
+            first_block, last_block = self.get_sample_block_range(first_sample, last_sample)
+            instrument.count('decode', bytes = out.shape[1] * len(indices) * 2, blocks = last_block - first_block)
+        if raw:
+            first_block, last_block = self.get_sample_block_range(first_sample, last_sample)
+            scales = self.get_block_scales()[first_block:last_block]
+            offset = first_sample - first_block * self.block_size
+            return self.key_by_channel([ScaledSamples(out[row], scales[:, j], offset, self.block_size)
+                                        for row, j in enumerate(indices)], channels)
+        return self.key_by_channel(out, channels)
+
+    @instrument.timed('voltage expansion')
+    def read_voltage_samples(self, first_sample, last_sample, out = None, channels = None):
+        """
+        Expands the per block voltages for samples [first_sample, last_sample).
+        :param out: Optional array of shape (selected channels, points) to expand into
+        :param channels: Channel indices or names, see get_channel_indices (Default = all channels)
+        :returns: 2D numpy array of shape (channels, points), one row per channel,
+            or with channels a dict of the rows keyed by channel name.
+        """
+        indices = self.get_channel_indices(channels)
+        first_sample, last_sample = self.clip_sample_range(first_sample, last_sample)
+        if out is None:
+            out = np.empty((len(indices), last_sample - first_sample))
+        block_voltages = self.get_block_voltages()
+        position = 0
+        for first_block, last_block, start, stop in self.get_block_pieces(first_sample, last_sample):
+            n_blocks = last_block - first_block
+            length = n_blocks * (stop - start)
+            target = out[:, position:position + length].reshape(len(indices), n_blocks, stop - start)
+            target[...] = block_voltages[first_block:last_block, indices].T[:, :, np.newaxis]
+            position += length
+        return self.key_by_channel(out, channels)
+
+    def iter_chunks(self, samples = 2**20, overlap = 0, first_sample = 0, last_sample = None, dtype = np.float64,
+                    channels = None, prefetch = None):
+        """
+        Walks the recording in chunks of at most samples points, consecutive
+        chunks sharing overlap points. Memory use is fixed: every chunk is
+        decoded into the same preallocated buffers, so copy a chunk to keep it
+        past the next iteration.
+        :param samples: Number of samples per chunk (Default = 2**20)
+        :param overlap: Number of samples shared by consecutive chunks (Default = 0)
+        :param first_sample: First sample to read (Default = 0)
+        :param last_sample: End of the samples to read, exclusive (Default = end of file)
+        :param dtype: Type of the current, see read_samples (Default = np.float64)
+        :param channels: Channel indices or names, see read_samples (Default = all channels)
+        :param prefetch: Number of chunks decoded ahead in a background thread, see
+            ChunkPrefetcher; 0 reads synchronously (Default = the reader's prefetch)
+        :returns: Generator of [offset, current, voltage], offset being the index of the
+            first sample of the chunk and current/voltage arrays of shape (channels, points);
+            for np.int16 current is a list of ScaledSamples, one for each channel. With
+            channels, current and voltage are dicts of the rows keyed by channel name.
+        """
+        if not 0 <= overlap < samples:
+            raise ValueError('Overlap must be non-negative and smaller than the chunk size')
+        last_sample = self.points_per_channel_total if last_sample is None else last_sample
+        first_sample, last_sample = self.clip_sample_range(first_sample, last_sample)
+        n_channels = len(self.get_channel_indices(channels))
+        bounds = self.get_chunk_bounds(samples, overlap, first_sample, last_sample)
+        prefetch = self.prefetch if prefetch is None else prefetch
+        if prefetch > 0 and len(bounds) > 1:
+            prefetcher = ChunkPrefetcher(self, bounds, prefetch, n_channels, samples, dtype, channels)
+            self.prefetchers.add(prefetcher)
+            for chunk in prefetcher:
+                yield chunk
+            return
+        current = np.empty((n_channels, samples), dtype=dtype)
+        voltage = np.empty((n_channels, samples))
+        for offset, stop in bounds:
+            length = stop - offset
+            chunk = self.read_samples(offset, stop, out = current[:, :length], dtype = dtype, channels = channels)
+            voltages = self.read_voltage_samples(offset, stop, out = voltage[:, :length], channels = channels)
+            yield [offset, chunk, voltages]
+
+    def get_chunk_bounds(self, samples, overlap, first_sample, last_sample):
+        """
+        :returns: List of [first_sample, last_sample] of the chunks of iter_chunks
+        """
+        bounds = []
+        offset = first_sample
+        while offset < last_sample:
+            stop = min(offset + samples, last_sample)
+            bounds.append([offset, stop])
+            if stop == last_sample:
+                break
+            offset = stop - overlap
+        return bounds
+
+    def get_sample_rate(self):
+        return self.sample_rate
+    
+    def get_all_data(self, decimate = False, dtype = np.float64, channels = None):
+        """
+        Reads files created by the Heka acquisition software and returns the data.
+        Current and voltage are taken from the same pass over the blocks.
+        :param dtype: Type of the current, see read_samples; decimated current is
+            never raw, so np.int16 gives float64 there (Default = np.float64)
+        :param channels: Channel indices or names to read, see get_channel_indices (Default = all channels)
+        :returns: [data, voltages], where data is a list of numpy arrays, one for
+            each channel, and voltages a list of VoltageSteps, one for each channel.
+            With channels, both are dicts keyed by channel name.
+        """
+        indices = self.get_channel_indices(channels)
+        if decimate:  # If decimating, just keep max and min value from each block
+            block_max, block_min = self.get_block_stats(moments = False, channels = indices)[:2]
+            data = []
+            for column in range(len(indices)):
+                channel = np.empty(self.num_blocks_in_file * 2, dtype=get_envelope_dtype(dtype))
+                channel[0::2] = block_max[:, column]
+                channel[1::2] = block_min[:, column]
+                data.append(channel)
+        else:
+            data = list(self.get_scaled_blocks(dtype = dtype, channels = indices).values())
+
+        # if decimate:
+        #     self.decimate_sample_rate = self.sample_rate * 2 / self.points_per_channel_per_block  # we are downsampling
+        voltages = self.get_voltage_steps(self.get_block_voltages()[:, indices], decimate = decimate)
+
+        return [self.key_by_channel(data, channels), self.key_by_channel(voltages, channels)]
+
+    def get_all_voltages(self, decimate = False, channels = None):
+        """
+        Returns a time series of the voltage, read from the block headers only.
+        :param channels: Channel indices or names, see get_channel_indices (Default = all channels)
+        :returns: List of VoltageSteps, one for each channel, or with channels a dict keyed by channel name.
+        """
+        indices = self.get_channel_indices(channels)
+        return self.key_by_channel(self.get_voltage_steps(self.get_block_voltages()[:, indices], decimate = decimate),
+                                   channels)
+
+    def get_voltage_plateaus(self, channel = 0):
+        """
+        Finds the contiguous runs of constant applied voltage from the block
+        headers alone, without decoding any samples.
+        :param channel: Index or name of the channel whose voltage is followed (Default = 0)
+        :returns: List of [first_sample, last_sample, voltage], last_sample exclusive
+        """
+        block_voltages = self.scan_block_channel_params('Voltage')
+        steps = self.get_voltage_steps(block_voltages[:, self.get_channel_indices(channel)])[0]
+        stops = np.append(steps.starts[1:], steps.length)
+        return [[int(first), int(last), float(voltage)]
+                for first, last, voltage in zip(steps.starts, stops, steps.values)]
+
+    def get_voltage_steps(self, block_voltages, decimate = False):
+        samples_per_block = 2 if decimate else self.block_size  # max and min of a block are its voltage
+        return [VoltageSteps.from_blocks(block_voltages[:, j], samples_per_block)
+                for j in range(block_voltages.shape[1])]
+
+    def get_next_blocks(self, n_blocks=1, dtype=np.float64, channels=None):
+        """
+        Get the next n blocks of data.
+        :param int n_blocks: Number of blocks to grab.
+        :param dtype: Type of the data, see read_samples (Default = np.float64)
+        :param channels: Channel indices or names, see read_samples (Default = all channels)
+        :returns: List of numpy arrays, one for each channel, or with channels a dict keyed by channel name.
+        """
+        first_block = (self.heka_file.tell() - self.per_file_header_length) // self.total_bytes_per_block
+        last_block = min(first_block + n_blocks, self.num_blocks_in_file)
+        if last_block <= first_block:
+            if channels is not None:
+                return self.key_by_channel([np.empty(0) for j in self.get_channel_indices(channels)], channels)
+            return [np.empty(0)]
+        # decode straight into the returned arrays and move past the blocks read
+        data = self.get_scaled_blocks(first_block, last_block, dtype = dtype, channels = channels)
+        self.heka_file.seek(self.per_file_header_length + last_block * self.total_bytes_per_block)
+        return data if channels is not None else list(data)
+
+    def read_heka_next_block_voltages(self):
+        """
+        Reads the next block of heka voltages.
+        Returns a dictionary with 'data', 'per_block_params', and 'per_channel_params'.
+        """  # Read block header
+        per_block_params = self.read_heka_header_params(self.per_block_param_list)
+        if per_block_params is None:
+            return [np.empty(0)]
+
+        # Read per channel header
+        per_channel_block_params = []
+        for _ in self.channel_list:  # underscore used for discarded parameters
+            channel_params = {}
+            # i[0] = name, i[1] = datatype
+            for i in self.per_channel_param_list:
+                channel_params[i[0]] = np.fromfile(self.heka_file, i[1], 1)[0]
+            per_channel_block_params.append(channel_params)
+
+        # Read data
+        data = []
+        dt = np.dtype('>i2')  # int16
+        values = np.ndarray([])
+        tmp = np.ndarray([])
+        for i in range(0, len(self.channel_list)):
+            values = 1.0 * np.ones(self.block_size) * per_channel_block_params[i][bytes('Voltage', 'utf-8')]
+            # get rid of nan's
+            #         values[np.isnan(values)] = 0
+            tmp = np.fromfile(self.heka_file, dt, count=self.block_size)
+            data.append(values)
+
+        return data
+
+    def read_heka_next_block(self):
+        """
+        Reads the next block of heka data.
+        Returns a dictionary with 'data', 'per_block_params', and 'per_channel_params'.
+        """  # Read block header
+        per_block_params = self.read_heka_header_params(self.per_block_param_list)
+        if per_block_params is None:
+            return [np.empty(0)]
+
+        # Read per channel header
+        per_channel_block_params = []
+        for _ in self.channel_list:  # underscore used for discarded parameters
+            channel_params = {}
+            # i[0] = name, i[1] = datatype
+            for i in self.per_channel_param_list:
+                channel_params[i[0]] = np.fromfile(self.heka_file, i[1], 1)[0]
+            per_channel_block_params.append(channel_params)
+
+        # Read data
+        data = []
+        dt = np.dtype('>i2')  # int16
+        values = np.ndarray([])
+        for i in range(0, len(self.channel_list)):
+            values = np.fromfile(self.heka_file, dt, count=self.block_size) * \
+                     per_channel_block_params[i][
+                         bytes('Scale', 'utf-8')]
+            # get rid of nan's
+            #         values[np.isnan(values)] = 0
+            data.append(values)
+
+        return data
+
+    def read_heka_header_params(self, param_list):
+        params = {}
+        # pair[0] = name, pair[1] = np.datatype
+        array = np.ndarray([])
+        for pair in param_list:
+            array = np.fromfile(self.heka_file, pair[1], 1)
+            if array.size > 0:
+                params[pair[0]] = array[0]
+            else:
+                return None
+        return params
+
+    def read_heka_header_param_list(self, datatype):
+        """
+        Reads the binary parameter list of the following format:
+            3 null bytes
+            1 byte uint8 - how many params following
+            params - 1 byte uint8 - code for datatype (eg encoding[code])
+                     datatype.intemsize bytes - name the parameter
+        Returns a list of parameters, with
+            item[0] = name
+            item[1] = numpy datatype
+        """
+        param_list = []
+        self.heka_file.read(3)  # read null characters?
+        dt = np.dtype('>u1')
+        num_params = np.fromfile(self.heka_file, dt, 1)[0]
+        for _ in range(0, num_params):  # underscore used for discarded parameters
+            type_code = np.fromfile(self.heka_file, dt, 1)[0]
+            name = np.fromfile(self.heka_file, datatype, 1)[0].strip()
+            param_list.append([name, ENCODINGS[type_code]])
+        return param_list
\ No newline at end of file
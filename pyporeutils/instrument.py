@@ -0,0 +1,196 @@
+#!/usr/bin/env python
+
+"""
+Stage timers and counters for the reader and analyses
+
+Collection is off unless a profile is active, in which case every
+instrumented stage records its number of calls, total time and counters such
+as bytes and blocks read, and optionally its peak traced memory. A profile is
+started with the profile() context manager, or for a whole run by setting
+PYPORE_PROFILE to a JSON filename (or to 1 to print a summary) and
+PYPORE_PROFILE_MEMORY=1 for peak memory. Only the current process is
+measured, not worker processes; stages run by other threads, such as the
+prefetching reader, are added to the same report. When off, an instrumented call costs one
+global lookup.
+"""
+
+import atexit
+import contextlib
+import functools
+import json
+import os
+import sys
+import threading
+import time
+import tracemalloc
+
+_profile = None  # the active Profile, None when collection is off
+
+class NullStage:
+    """Stage context used while collection is off"""
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+NULL_STAGE = NullStage()
+
+class Profile:
+    """Per stage calls, time, counters and peak memory of one profiling session"""
+    def __init__(self, memory = False):
+        """
+        :param memory: Track peak memory of each stage with tracemalloc, slowing allocations down (Default = False)
+        """
+        self.memory = memory
+        self.stages = {}
+        self.lock = threading.Lock()
+        # open stages of each thread: [name, start time, traced memory at start, peak traced memory so far]
+        self.local = threading.local()
+        self.start_time = time.perf_counter()
+        self.started_tracemalloc = False
+
+    @property
+    def stack(self):
+        if not hasattr(self.local, 'stack'):
+            self.local.stack = []
+        return self.local.stack
+
+    def get_record(self, name):
+        if name not in self.stages:
+            self.stages[name] = {'calls': 0, 'seconds': 0.0}
+        return self.stages[name]
+
+    def enter(self, name):
+        current = 0
+        if self.memory:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                self.started_tracemalloc = True
+            current, peak = tracemalloc.get_traced_memory()
+            if self.stack:
+                self.stack[-1][3] = max(self.stack[-1][3], peak)
+            if hasattr(tracemalloc, 'reset_peak'):  # python >= 3.9, else peaks include earlier stages
+                tracemalloc.reset_peak()
+        self.stack.append([name, time.perf_counter(), current, current])
+
+    def exit(self):
+        name, start, current, peak = self.stack.pop()
+        seconds = time.perf_counter() - start
+        with self.lock:
+            record = self.get_record(name)
+            record['calls'] += 1
+            record['seconds'] += seconds
+        if self.memory:
+            peak = max(peak, tracemalloc.get_traced_memory()[1])
+            with self.lock:
+                record['peak_bytes'] = max(record.get('peak_bytes', 0), peak - current)
+            if self.stack:
+                self.stack[-1][3] = max(self.stack[-1][3], peak)
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        self.enter(name)
+        try:
+            yield
+        finally:
+            self.exit()
+
+    def count(self, name, **amounts):
+        with self.lock:
+            record = self.get_record(name)
+            for key, amount in amounts.items():
+                record[key] = record.get(key, 0) + int(amount)
+
+    def stop(self):
+        if self.started_tracemalloc:
+            tracemalloc.stop()
+            self.started_tracemalloc = False
+
+    def report(self):
+        """
+        :returns: Dict with the wall time of the session and a dict of stages, each
+            with calls, seconds, any counters and, with memory, peak_bytes
+        """
+        return {'seconds': time.perf_counter() - self.start_time, 'stages': self.stages}
+
+    def dump(self, fname):
+        with open(fname, 'w') as f:
+            json.dump(self.report(), f, indent = 1)
+
+    def print_summary(self, file = sys.stderr):
+        report = self.report()
+        print("%-20s %8s %10s %12s %10s" % ('stage', 'calls', 'seconds', 'MB read', 'peak MB'), file = file)
+        for name, record in sorted(report['stages'].items(), key = lambda item: -item[1]['seconds']):
+            print("%-20s %8d %10.4f %12.1f %10.1f" % (name, record['calls'], record['seconds'],
+                                                     record.get('bytes', 0)/1e6, record.get('peak_bytes', 0)/1e6),
+                  file = file)
+        print("Total %.4f s" % report['seconds'], file = file)
+
+def is_enabled():
+    return _profile is not None
+
+def get_profile():
+    """
+    :returns: The active Profile, or None when collection is off
+    """
+    return _profile
+
+def stage(name):
+    """Context manager timing a stage of the active profile, doing nothing when off"""
+    if _profile is None:
+        return NULL_STAGE
+    return _profile.stage(name)
+
+def count(name, **amounts):
+    """Add amounts, eg bytes = 1024, blocks = 2, to the counters of a stage of the active profile"""
+    if _profile is not None:
+        _profile.count(name, **amounts)
+
+def timed(name):
+    """Decorator timing every call of a function as a stage of the active profile"""
+    def decorate(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if _profile is None:
+                return func(*args, **kwargs)
+            with _profile.stage(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorate
+
+@contextlib.contextmanager
+def profile(memory = False, output = None):
+    """Collect stage timings and counters for the duration of the block
+
+    :param memory: Also track peak memory of each stage (Default = False)
+    :param output: Filename of a JSON report written at the end (Default = None)
+    :returns: The Profile, whose report() can be read after the block
+
+    """
+    global _profile
+    previous = _profile
+    _profile = Profile(memory)
+    try:
+        yield _profile
+    finally:
+        _profile.stop()
+        if output is not None:
+            _profile.dump(output)
+        _profile = previous
+
+def profile_at_exit(target, memory = False):
+    """Profile the rest of the process, writing the report to target at exit, or printing it for 1"""
+    global _profile
+    _profile = Profile(memory)
+
+    def finish(session = _profile):
+        session.stop()
+        if target in ('1', 'stderr'):
+            session.print_summary()
+        else:
+            session.dump(target)
+    atexit.register(finish)
+
+if os.environ.get('PYPORE_PROFILE'):
+    profile_at_exit(os.environ['PYPORE_PROFILE'], os.environ.get('PYPORE_PROFILE_MEMORY') == '1')
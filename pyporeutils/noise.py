@@ -0,0 +1,817 @@
+#!/usr/bin/env python
+
+# CALCULATE NOISE PSD FOR A TIME TRACE
+
+import csv
+import glob
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+import numpy as np
+
+from . import heka_reader as heka
+from . import instrument
+
+# scipy and matplotlib are imported where they are used, so importing this
+# module (e.g. in worker processes) only costs numpy
+
+def get_pyplot():
+    """Import pyplot on first use with the settings used for long traces"""
+    import matplotlib.pyplot as plt
+    plt.rcParams['agg.path.chunksize'] = 20000
+    return plt
+
+def invf(x, a, alpha):
+    return a/(x**alpha)
+
+@instrument.timed('welch')
+def noise_psd(i, fs):
+    from scipy import signal
+    f, psd = signal.welch(i, fs, nperseg = 2**16)
+    fspec, pspec = signal.welch(i, fs, 'flattop', nperseg = 2**16, scaling = 'spectrum')
+    return np.asarray([psd, f, pspec, fspec])
+
+class WelchAccumulator:
+    """Welch PSD built up chunk by chunk, giving the same result as noise_psd
+    
+    Segments of nperseg samples overlapping by half are detrended, windowed and
+    transformed as soon as they are complete; only the partial segment at the
+    end of the data seen so far is kept between chunks.
+    
+    """
+    def __init__(self, fs, nperseg = 2**16, batch_segments = 16):
+        """
+        :param fs: Sample rate in Hz
+        :param nperseg: Samples per Welch segment, as in noise_psd (Default = 2**16)
+        :param batch_segments: Segments transformed at once, bounds the working memory (Default = 16)
+        """
+        from scipy import signal
+        self.fs = fs
+        self.nperseg = nperseg
+        self.step = nperseg - nperseg//2
+        self.batch_segments = batch_segments
+        # [density with hann window, spectrum with flattop window], as in noise_psd
+        self.windows = [signal.get_window('hann', nperseg), signal.get_window('flattop', nperseg)]
+        self.scales = [1.0/(fs*(self.windows[0]**2).sum()), 1.0/self.windows[1].sum()**2]
+        self.sums = [np.zeros(nperseg//2 + 1), np.zeros(nperseg//2 + 1)]
+        self.n_segments = 0
+        self.n_samples = 0
+        self.total = 0.0
+        self.buffer = np.empty(0)
+
+    @instrument.timed('welch')
+    def update(self, chunk):
+        """Add the next samples of the trace
+        
+        :param chunk: 1D numpy array of samples following the previous chunk
+        
+        """
+        from scipy import fft as sp_fft
+        from scipy import signal
+        chunk = np.asarray(chunk, dtype = np.float64)
+        self.n_samples += len(chunk)
+        self.total += chunk.sum()
+        data = np.concatenate((self.buffer, chunk))
+        if len(data) < self.nperseg:
+            self.buffer = data
+            return
+        n_segments = (len(data) - self.nperseg)//self.step + 1
+        segments = np.lib.stride_tricks.sliding_window_view(data, self.nperseg)[::self.step][:n_segments]
+        for first in range(0, n_segments, self.batch_segments):
+            batch = signal.detrend(segments[first:first + self.batch_segments], type = 'constant')
+            for window, power_sum in zip(self.windows, self.sums):
+                spectrum = sp_fft.rfft(window*batch)
+                power_sum += (np.conjugate(spectrum)*spectrum).real.sum(axis = 0)
+        self.n_segments += n_segments
+        self.buffer = data[n_segments*self.step:]
+
+    def mean(self):
+        """Mean of all samples added so far"""
+        return self.total/self.n_samples
+
+    def result(self):
+        """Spectra of all samples added so far
+        
+        :returns: Numpy array of [psd, f, pspec, fspec], as returned by noise_psd
+        
+        """
+        from scipy import fft as sp_fft
+        if self.n_segments == 0:  # shorter than one segment, welch shrinks nperseg itself
+            return noise_psd(self.buffer, self.fs)
+        spectra = []
+        for power_sum, scale in zip(self.sums, self.scales):
+            spectrum = power_sum*scale/self.n_segments
+            if self.nperseg % 2:
+                spectrum[1:] *= 2
+            else:  # Nyquist point is unpaired
+                spectrum[1:-1] *= 2
+            spectra.append(spectrum)
+        f = sp_fft.rfftfreq(self.nperseg, 1/self.fs)
+        return np.asarray([spectra[0], f, spectra[1], f])
+
+def noise_psd_stream(reader, start = 0, stop = 0, gain = 1e12, channel = 0, chunk_size = 2**22):
+    """Welch PSD of a time window of an open HekaReader, reading it chunk by chunk with constant memory
+    
+    :param reader: HekaReader of the file to be processed
+    :param start: Start of the window in s (Default = 0)
+    :param stop: End of the window in s, 0 reads to the end of the file (Default = 0)
+    :param gain: Factor applied to the current before the PSD, 1e12 gives pA (Default = 1e12)
+    :param channel: Index of the channel to analyse (Default = 0)
+    :param chunk_size: Samples decoded at once (Default = 2**22)
+    :returns: WelchAccumulator holding the spectra and the mean of the scaled current
+    
+    """
+    first_sample, last_sample = reader.get_sample_range(start, stop)
+    return accumulate_psd(reader, first_sample, last_sample, gain, channel, chunk_size)
+
+def accumulate_psd(reader, first_sample, last_sample, gain = 1e12, channel = 0, chunk_size = 2**22, nperseg = 2**16):
+    """Welch PSD of samples [first_sample, last_sample) of an open HekaReader, see noise_psd_stream"""
+    accumulator = WelchAccumulator(reader.get_sample_rate(), nperseg)
+    name = reader.get_channel_names(channel)[0]
+    for offset, current, voltage in reader.iter_chunks(chunk_size, 0, first_sample, last_sample, channels = channel):
+        accumulator.update(current[name]*gain)
+    return accumulator
+
+def find_nearest(array, value):
+    return (np.abs(array-value)).argmin()  #return index of the closest value in a numpy array
+
+def fit(f, psd, func, stop = 1000, start = 1):
+    start_idx = find_nearest(f, start)
+    stop_idx = find_nearest(f, stop)
+    xdata = f[start_idx:stop_idx]
+    ydata = psd[start_idx:stop_idx]
+    if func is invf:
+        popt, pcov = fit_invf(f, psd, start, stop)
+        popt, pcov = popt[0], pcov[0]
+        if not np.all(np.isfinite(popt)):
+            raise RuntimeError('Optimal parameters not found: fewer than two points between %g and %g Hz' % (start, stop))
+    else:
+        from scipy.optimize import curve_fit
+        with instrument.stage('curve_fit'):
+            popt, pcov = curve_fit(func, xdata, ydata)
+    return [xdata, popt, pcov]
+
+def get_fit_selection(f, start, stop, mask):
+    """Points of each spectrum fitted by fit_invf
+    
+    As in fit, the range runs from the kept frequency nearest start up to, but
+    not including, the kept frequency nearest stop; zero frequency is never fitted.
+    
+    :param f: 1D numpy array of frequencies in Hz
+    :param mask: 2D boolean numpy array, False for points dropped from a spectrum
+    :returns: 2D boolean numpy array of the points to fit
+    
+    """
+    index = np.arange(len(f))
+    if len(mask) and mask.strides[0] == 0:  # the same for every spectrum
+        first = np.argmin(np.where(mask[0], np.abs(f - start), np.inf))
+        last = np.argmin(np.where(mask[0], np.abs(f - stop), np.inf))
+        return np.broadcast_to(mask[0] & (index >= first) & (index < last) & (f > 0), mask.shape)
+    first = np.argmin(np.where(mask, np.abs(f - start), np.inf), axis = 1)
+    last = np.argmin(np.where(mask, np.abs(f - stop), np.inf), axis = 1)
+    return mask & (index >= first[:, np.newaxis]) & (index < last[:, np.newaxis]) & (f > 0)
+
+def get_invf_normal_equations(log_f, psd, selection, a, alpha):
+    """
+    :param log_f: Natural log of the frequencies
+    :param psd: Spectra, zero outside selection
+    :param selection: 0 or 1 for every point of psd, 1 where it is fitted
+    :returns: [J^T J as [jaa, jab, jbb], J^T r as [ga, gb], sum of squared residuals] of the
+        linear space residuals r = psd - a/f^alpha of each spectrum, for the parameters [a, alpha]
+    """
+    with np.errstate(over = 'ignore', invalid = 'ignore'):
+        power = np.exp(-alpha[:, np.newaxis]*log_f)*selection
+        model = a[:, np.newaxis]*power
+        d_alpha = -model*log_f
+        residuals = psd - model
+    jaa = np.einsum('ij,ij->i', power, power)
+    jab = np.einsum('ij,ij->i', power, d_alpha)
+    jbb = np.einsum('ij,ij->i', d_alpha, d_alpha)
+    ga = np.einsum('ij,ij->i', power, residuals)
+    gb = np.einsum('ij,ij->i', d_alpha, residuals)
+    return [[jaa, jab, jbb], [ga, gb], np.einsum('ij,ij->i', residuals, residuals)]
+
+@instrument.timed('invf fit')
+def fit_invf(f, psd, start = 1, stop = 1000, mask = None, weights = None, refine = True, max_iter = 100):
+    """Fit a/f^alpha to many spectra at once
+    
+    Each spectrum is first fitted in closed form, by weighted linear least
+    squares of log(psd) on log(f). The default weights psd^2 make this a first
+    order approximation of least squares on psd itself, which is what
+    scipy.optimize.curve_fit did in fit. With refine, Levenberg-Marquardt
+    steps on the linear space residuals, taken for all spectra together, then
+    converge to that least squares solution. Points with psd <= 0 are left out
+    of the log-log fit only.
+    
+    :param f: 1D numpy array of frequencies in Hz
+    :param psd: Numpy array with one spectrum per row, or a 1D spectrum
+    :param start: Frequency in Hz nearest the first point of the fit (Default = 1)
+    :param stop: Frequency in Hz nearest the point ending the fit, excluded (Default = 1000)
+    :param mask: Boolean numpy array like psd, False drops a point from its spectrum (Default = None)
+    :param weights: Weights of the log-log fit, broadcast against psd (Default = psd^2)
+    :param refine: Refine to the least squares solution on psd (Default = True)
+    :param max_iter: Maximum number of refining steps (Default = 100)
+    :returns: [popt, pcov]: [a, alpha] of each spectrum as a (spectra, 2) numpy array, and
+        their covariance as a (spectra, 2, 2) numpy array, estimated from the residuals as
+        curve_fit does. popt is nan for spectra with fewer than two points to fit and pcov
+        is inf for those with only two
+    
+    """
+    psd = np.atleast_2d(np.asarray(psd, dtype = np.float64))
+    f = np.asarray(f, dtype = np.float64)
+    mask = np.broadcast_to(True if mask is None else mask, psd.shape)
+    selection = get_fit_selection(f, start, stop, mask)
+    n_points = selection.sum(axis = 1)
+    if weights is not None:
+        weights = np.broadcast_to(weights, psd.shape)
+    # only the frequencies fitted in some spectrum take part from here on
+    columns = np.flatnonzero(selection.any(axis = 0))
+    columns = slice(columns[0], columns[-1] + 1) if len(columns) else slice(0, 0)
+    f, psd, selection = f[columns], psd[:, columns], selection[:, columns]
+
+    # closed form weighted least squares in log-log space
+    log_selection = selection & (psd > 0)
+    if weights is None:
+        scale = np.max(np.where(log_selection, psd, 0), axis = 1, keepdims = True, initial = 0)
+        weights = (psd/np.where(scale > 0, scale, 1))**2
+    else:
+        weights = weights[:, columns]
+    w = np.where(log_selection, weights, 0)
+    x = np.log(np.where(f > 0, f, 1))  # f > 0 wherever selected
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        y = np.where(log_selection, np.log(np.where(log_selection, psd, 1)), 0)
+        sw = w.sum(axis = 1)
+        sx = w @ x
+        sy = (w*y).sum(axis = 1)
+        sxx = w @ (x*x)
+        sxy = (w*y) @ x
+        slope = (sw*sxy - sx*sy)/(sw*sxx - sx*sx)
+        a = np.exp((sy - slope*sx)/sw)
+    alpha = -slope
+    a[log_selection.sum(axis = 1) < 2] = np.nan
+
+    valid = np.isfinite(a) & np.isfinite(alpha)
+    psd = np.where(selection, psd, 0)
+    selection = selection.astype(np.float64)
+    if refine and valid.any():
+        a[valid], alpha[valid] = refine_invf(x, psd[valid], selection[valid], a[valid], alpha[valid], max_iter)
+
+    # covariance as curve_fit estimates it: inv(J^T J) scaled by the residual variance
+    (jaa, jab, jbb), gradient, ssr = get_invf_normal_equations(x, psd, selection, np.nan_to_num(a),
+                                                               np.nan_to_num(alpha))
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        determinant = jaa*jbb - jab*jab
+        variance = np.where(n_points > 2, ssr/(n_points - 2), np.inf)
+        pcov = np.stack([np.stack([jbb, -jab], axis = -1), np.stack([-jab, jaa], axis = -1)], axis = -2)
+        pcov = pcov*(variance/determinant)[:, np.newaxis, np.newaxis]
+    popt = np.stack([a, alpha], axis = -1)
+    popt[~valid | (n_points < 2)] = np.nan
+    pcov[~np.isfinite(popt).all(axis = 1)] = np.nan
+    return [popt, pcov]
+
+def refine_invf(log_f, psd, selection, a, alpha, max_iter = 100, ftol = 1e-10):
+    """Levenberg-Marquardt steps of fit_invf, taken for all spectra not converged yet together
+    
+    :param log_f: Natural log of the frequencies
+    :param psd: Spectra, zero outside selection
+    :param selection: 0 or 1 for every point of psd, 1 where it is fitted
+    :param a: Starting values of a
+    :param alpha: Starting values of alpha
+    :param max_iter: Maximum number of steps (Default = 100)
+    :param ftol: Relative decrease of the squared residuals below which a spectrum has converged (Default = 1e-10)
+    :returns: [a, alpha] minimizing the squared residuals on psd of each spectrum
+    
+    """
+    a = a.copy()
+    alpha = alpha.copy()
+    (jaa, jab, jbb), (ga, gb), ssr = get_invf_normal_equations(log_f, psd, selection, a, alpha)
+    damping = np.full(len(a), 1e-3)
+    rows = np.arange(len(a))
+    for _ in range(max_iter):
+        # damped normal equations of the remaining spectra, solved in closed form
+        daa = jaa[rows]*(1 + damping[rows])
+        dbb = jbb[rows]*(1 + damping[rows])
+        with np.errstate(divide = 'ignore', invalid = 'ignore'):
+            determinant = daa*dbb - jab[rows]**2
+            trial_a = a[rows] + (dbb*ga[rows] - jab[rows]*gb[rows])/determinant
+            trial_alpha = alpha[rows] + (daa*gb[rows] - jab[rows]*ga[rows])/determinant
+        (taa, tab, tbb), (tga, tgb), trial_ssr = get_invf_normal_equations(log_f, psd[rows], selection[rows],
+                                                                           trial_a, trial_alpha)
+        better = np.isfinite(trial_ssr) & (trial_ssr < ssr[rows])
+        converged = better & (ssr[rows] - trial_ssr <= ftol*ssr[rows])
+        accepted = rows[better]
+        a[accepted], alpha[accepted], ssr[accepted] = trial_a[better], trial_alpha[better], trial_ssr[better]
+        jaa[accepted], jab[accepted], jbb[accepted] = taa[better], tab[better], tbb[better]
+        ga[accepted], gb[accepted] = tga[better], tgb[better]
+        damping[rows] = np.where(better, damping[rows]/10, damping[rows]*10)
+        rows = rows[~converged & (damping[rows] < 1e10)]
+        if not len(rows):
+            break
+    return [a, alpha]
+
+@instrument.timed('render')
+def plot_noise(option, data, view_controls = True, view_fit = True):
+    # i in pA
+    # v in V
+    
+    plt = get_pyplot()
+    from matplotlib.widgets import Slider, Button
+    
+    view_traces, view_current_trace, view_noise = option
+    
+    if view_traces == True and len(data) == 1:
+        v, i, t, f, psd, Avalue, popt, mean_current, I_rms, x, invfx = data[0]
+        fig_traces, ax_traces = plt.subplots(2, sharex=True)
+        ax_traces[0].plot(t, v*1000)
+        ax_traces[0].set_ylabel('Voltage (mV)')
+        ax_traces[1].plot(t, i*1e-3)
+        ax_traces[1].set_ylabel('Current (nA)')
+        ax_traces[1].set_xlabel('Time (s)')
+
+    if view_current_trace == True:
+        plt.figure(figsize=(10,8.25))
+        plt.minorticks_on()
+        plt.tick_params(axis = 'both', which = 'major', labelsize = 16)
+        plt.tick_params(axis = 'both', which = 'major', length = 8, width = 1, direction = 'in')
+        plt.tick_params(axis = 'both', which = 'minor', length = 4, width = 1, direction = 'in')
+        
+        for dataset in data:
+            v, i, t, f, psd, Avalue, popt, mean_current, I_rms, x, invfx = dataset
+            plt.plot(t, i*1e-3)
+            axp = plt.gca()
+            axp.set_xlabel('Time (s)')
+            axp.set_ylabel('Current (nA)')
+            #plt.ylim(1.5, 5)
+            #plt.xlim(0, max(t))
+    
+    if view_noise == True:
+        #plt.loglog(fspec, np.sqrt(pspec))
+        fig = plt.figure(figsize=(10,8.25))
+        ax = fig.add_subplot(111)
+        ax.tick_params(axis='both', which='major', labelsize=16)
+        #ax = plt.gca()
+        #plt.ylim(1e-2, 1e4)
+        ax.set_xlim(5,1e4)
+        ax.minorticks_on()
+        ax.tick_params('both', length = 8, width = 1, which = 'major', direction = 'in')
+        ax.tick_params('both', length = 4, width = 1, which = 'minor', direction = 'in')
+        
+        for dataset in data:
+            v, i, t, f, psd, Avalue, popt, mean_current, I_rms, x, invfx = dataset
+        
+            ax.loglog(f, psd)
+            ax.set_xlabel('Fequency (Hz)')
+            ax.set_ylabel('PSD')
+        
+            if len(data) == 1:
+                t = ax.text(0.05, 0.1,(u"A = %0.2e; \u03B1 = %0.2f" % (Avalue, popt[1])),
+                 horizontalalignment='left',
+                 verticalalignment='center',
+                 transform = ax.transAxes)
+                t2 = ax.text(0.05, 0.15,("I = %0.2f nA; I_rms = %0.2f pA" % (mean_current, I_rms)),
+                 horizontalalignment='left',
+                 verticalalignment='center',
+                 transform = ax.transAxes)
+        
+        
+            if view_fit == True:
+                [fit_line] = ax.loglog(x, invf(x, *popt))
+            '''
+                if view_controls == True and len(data) == 1:
+                    fig.subplots_adjust(bottom=0.25)
+                    a_0 = popt[0]
+                    alpha_0 = popt[1]
+
+                    # Add two sliders for tweaking the parameters
+                    a_slider_ax  = fig.add_axes([0.15, 0.15, 0.75, 0.03])
+                    a_slider = Slider(a_slider_ax, r'$Log(A*I^2)$', -4, 8, valinit=np.log10(a_0), dragging=True)
+                    alpha_slider_ax = fig.add_axes([0.15, 0.1, 0.75, 0.03])
+                    alpha_slider = Slider(alpha_slider_ax, r'$\alpha$', 0, 2, valinit=alpha_0, dragging=True)
+                    def sliders_on_changed(val):
+                        fit_line.set_ydata(invf(x, 10**a_slider.val, alpha_slider.val))
+                        new_Aval = 10**(a_slider.val)/(np.mean(i)**2)
+                        t.set_text(u"A = %0.2e; \u03B1 = %0.2f" % (new_Aval, alpha_slider.val))
+                        fig.canvas.draw_idle()
+                    a_slider.on_changed(sliders_on_changed)
+                    alpha_slider.on_changed(sliders_on_changed)
+
+                    # Add a button for resetting the parameters
+                    reset_button_ax = fig.add_axes([0.8, 0.025, 0.1, 0.05])
+                    reset_button = Button(reset_button_ax, 'Reset', hovercolor='red')
+                    def reset_button_on_clicked(mouse_event):
+                        alpha_slider.reset()
+                        a_slider.reset()
+                    reset_button.on_clicked(reset_button_on_clicked)
+            '''
+        #legend = ax.legend(labels = ["SA_LD2.5", "PQ_LD2.5", "PI_LD3", "PK_LD3", "PB_LD4", "PV_LD2"])
+    
+
+def noise(fname, extract_lims = [[0, 0], [0, 0]], noise_lims = [3, 1e3], options = [[True, False, False], [True, True, True]], option_select = 0, view = True, threshold = 0):
+    range_to_show = extract_lims[0 if option_select == 0 else 1]
+    reader = heka.HekaReader(fname)
+    i, t, fs, v, ttl = reader.extract_data(start = range_to_show[0], stop = range_to_show[1])
+    i = i*1e12
+    mean_current = (np.mean(i)/1e3)
+    print("--------------------------------------------------")
+    print(fname)
+    print("Mean current = %0.2f nA" % mean_current)
+
+    current_option = options[option_select]
+
+    psd, f, pspec, fspec = noise_psd(i, fs)
+    I_rms = np.sqrt(pspec.max())
+    print("I_rms = %0.2f pA" % I_rms)
+    
+    if threshold != 0:
+        difference = np.abs(np.diff(psd))
+        outlier_idx = difference < threshold
+        new_idx = np.hstack((outlier_idx, (False)))
+        #print(difference)
+        get_pyplot().loglog(difference[new_idx[:len(new_idx)-1]])
+        f = f[new_idx]
+        psd = psd[new_idx]
+    
+    x, popt, pcov = fit(f, psd, invf, start = noise_lims[0], stop = noise_lims[1])
+    print("-------------------------")
+    print("1/f Noise Characteristics")
+    print("-------------------------")
+    Avalue = popt[0]/(np.mean(i)**2)
+    print("A = %0.2e" % Avalue)
+    print(u"\u03B1 = %0.2f" % popt[1])
+    
+    if view == True:
+        k = [[v, i, t, f, psd, Avalue, popt, mean_current, I_rms, x, invf(x, *popt)]]
+        plot_noise(current_option, k)
+        get_pyplot().show()
+    else:
+        val = [v, i, t, f, psd, Avalue, popt, mean_current, I_rms, x, invf(x, *popt)]
+        return(val)
+
+NOISE_TABLE_COLUMNS = ['file', 'start', 'stop', 'mean_current', 'I_rms', 'A', 'alpha', 'fit_a',
+                       'cov_a_a', 'cov_a_alpha', 'cov_alpha_alpha', 'read_time', 'psd_time', 'fit_time',
+                       'total_time', 'error']
+
+def noise_spectrum(fname, window = [0, 0]):
+    """Read one window of a file and take its Welch PSD, leaving the fit to fit_spectra
+    
+    :param fname: Filename of .hkd file to be processed
+    :param window: Time window in s to analyse as [start, stop] ([0, 0] = entire range)
+    :returns: [result, f, psd, mean_i]: dictionary with the NOISE_TABLE_COLUMNS known before the fit,
+        frequencies in Hz, PSD in pA^2/Hz and mean current in pA; f and psd are None if the file could not be read
+    
+    """
+    result = dict((column, '') for column in NOISE_TABLE_COLUMNS)
+    result.update(file = fname, start = window[0], stop = window[1])
+    try:
+        t0 = time.perf_counter()
+        reader = heka.HekaReader(fname, prefetch = 2)  # read ahead while the PSD is computed
+        try:
+            # single streaming pass: PSD and mean current without loading the window
+            accumulator = noise_psd_stream(reader, start = window[0], stop = window[1])
+        finally:
+            reader.close_file()
+        t1 = time.perf_counter()
+        psd, f, pspec, fspec = accumulator.result()
+        mean_i = accumulator.mean()
+        t2 = time.perf_counter()
+        result.update(I_rms = np.sqrt(pspec.max()), read_time = t1-t0, psd_time = t2-t1)
+        return [result, f, psd, mean_i]
+    except Exception as e:  # keep going with the rest of the batch
+        result['error'] = "%s: %s" % (type(e).__name__, e)
+        return [result, None, None, None]
+
+def noise_summary(fname, window = [0, 0], noise_lims = [3, 1e3], threshold = 0, refine = True):
+    """Run the read, Welch PSD and 1/f fit steps for one window of a file without printing or plotting
+    
+    :param fname: Filename of .hkd file to be processed
+    :param window: Time window in s to analyse as [start, stop] ([0, 0] = entire range)
+    :param noise_lims: Frequency range in Hz of the 1/f fit (Default = [3, 1e3])
+    :param threshold: Drop PSD points whose jump from the previous point exceeds threshold, 0 keeps all (Default = 0)
+    :param refine: Least squares on the PSD rather than the closed form log-log fit, see fit_invf (Default = True)
+    :returns: Dictionary with the NOISE_TABLE_COLUMNS; current in nA, I_rms in pA, times in s,
+        read_time covering the streaming read and Welch pass
+    
+    """
+    return fit_spectra([noise_spectrum(fname, window)], noise_lims, threshold, refine)[0]
+
+def fit_spectra(spectra, noise_lims = [3, 1e3], threshold = 0, refine = True):
+    """Fit the spectra of many windows together, one noise_fit_table call per frequency grid
+    
+    :param spectra: List of [result, f, psd, mean_i] from noise_spectrum or plateau_spectrum
+    :param noise_lims: Frequency range in Hz of the 1/f fit (Default = [3, 1e3])
+    :param threshold: PSD outlier threshold, see noise_fit_stats (Default = 0)
+    :param refine: Least squares on the PSD rather than the closed form log-log fit, see fit_invf (Default = True)
+    :returns: List of the result dictionaries, updated with the fit and, for plateaus, the conductance;
+        fit_time is the share of each spectrum in its batched fit
+    
+    """
+    groups = {}  # files of different sample rates have different frequencies
+    for k, (result, f, psd, mean_i) in enumerate(spectra):
+        if f is not None:
+            groups.setdefault(f.tobytes(), []).append(k)
+    for members in groups.values():
+        t0 = time.perf_counter()
+        fits = noise_fit_table(spectra[members[0]][1], np.asarray([spectra[k][2] for k in members]),
+                               [spectra[k][0]['I_rms'] for k in members], [spectra[k][3] for k in members],
+                               noise_lims, threshold, refine)
+        fit_time = (time.perf_counter() - t0)/len(members)
+        for k, stats in zip(members, fits):
+            result = spectra[k][0]
+            result.update(stats)
+            if 'conductance' in result:
+                result['conductance'] = result['mean_current']/result['voltage'] if result['voltage'] != 0 else np.nan
+            if 'fit_time' in result:
+                result.update(fit_time = fit_time, total_time = result['read_time'] + result['psd_time'] + fit_time)
+    return [spectrum[0] for spectrum in spectra]
+
+def noise_fit_stats(f, psd, pspec, mean_i, noise_lims = [3, 1e3], threshold = 0, refine = True):
+    """Fit 1/f noise to a spectrum and collect its noise characteristics
+    
+    :param f: Frequencies of psd in Hz
+    :param psd: Power spectral density in pA^2/Hz
+    :param pspec: Flattop power spectrum in pA^2
+    :param mean_i: Mean current in pA
+    :param noise_lims: Frequency range in Hz of the 1/f fit (Default = [3, 1e3])
+    :param threshold: Drop PSD points whose jump from the previous point exceeds threshold, 0 keeps all (Default = 0)
+    :param refine: Least squares on the PSD rather than the closed form log-log fit, see fit_invf (Default = True)
+    :returns: Dictionary of mean_current (nA), I_rms (pA), A, alpha, fit_a and the fit covariance
+    
+    """
+    result = noise_fit_table(f, psd, [np.sqrt(pspec.max())], [mean_i], noise_lims, threshold, refine)[0]
+    if result.pop('error'):
+        raise RuntimeError('Optimal parameters not found between %g and %g Hz' % tuple(noise_lims))
+    return result
+
+def noise_fit_table(f, psd, I_rms, mean_i, noise_lims = [3, 1e3], threshold = 0, refine = True):
+    """Fit 1/f noise to many spectra in one call and collect their noise characteristics
+    
+    :param f: Frequencies of psd in Hz
+    :param psd: Power spectral densities in pA^2/Hz, one spectrum per row
+    :param I_rms: RMS current in pA of each spectrum, the root of its flattop spectrum peak
+    :param mean_i: Mean current in pA of each spectrum
+    :param noise_lims: Frequency range in Hz of the 1/f fit (Default = [3, 1e3])
+    :param threshold: Drop PSD points whose jump from the previous point exceeds threshold, 0 keeps all (Default = 0)
+    :param refine: Least squares on the PSD rather than the closed form log-log fit, see fit_invf (Default = True)
+    :returns: List of dictionaries as returned by noise_fit_stats, plus error, set for spectra that could not be fitted
+    
+    """
+    psd = np.atleast_2d(psd)
+    mask = None
+    if threshold != 0:
+        mask = np.hstack((np.abs(np.diff(psd, axis = 1)) < threshold, np.zeros((len(psd), 1), dtype = bool)))
+    popt, pcov = fit_invf(f, psd, noise_lims[0], noise_lims[1], mask, refine = refine)
+    results = []
+    for rms, mean, (a, alpha), cov in zip(I_rms, mean_i, popt, pcov):
+        results.append(dict(mean_current = mean/1e3, I_rms = rms, A = a/(mean**2), alpha = alpha, fit_a = a,
+                            cov_a_a = cov[0][0], cov_a_alpha = cov[0][1], cov_alpha_alpha = cov[1][1],
+                            error = '' if np.isfinite(a) else 'RuntimeError: Optimal parameters not found'))
+    return results
+
+def expand_noise_files(patterns, window = [0, 0]):
+    """Expand file names or glob patterns into (filename, window) pairs
+    
+    :param patterns: List of .hkd filenames or glob patterns; append @start:stop to give a pattern its own window in s
+    :param window: Window used for patterns without their own (Default = [0, 0])
+    :returns: List of [filename, [start, stop]]
+    
+    """
+    tasks = []
+    for pattern in patterns:
+        file_window = window
+        if '@' in pattern:
+            pattern, lims = pattern.rsplit('@', 1)
+            file_window = [float(lim) for lim in lims.split(':')]
+        fnames = sorted(glob.glob(pattern)) if glob.has_magic(pattern) else [pattern]
+        tasks.extend([fname, file_window] for fname in fnames)
+    return tasks
+
+def noise_batch(tasks, noise_lims = [3, 1e3], threshold = 0, processes = None, output = None, refine = True):
+    """Run noise_summary for many files: the spectra are taken in a process pool, then fitted in one call
+    
+    :param tasks: List of filenames or of [filename, [start, stop]] pairs
+    :param noise_lims: Frequency range in Hz of the 1/f fit (Default = [3, 1e3])
+    :param threshold: PSD outlier threshold passed to noise_summary (Default = 0)
+    :param processes: Number of worker processes, 1 runs in this process (Default = number of CPUs)
+    :param output: Filename of a .csv results table to write (Default = None)
+    :param refine: Least squares on the PSD rather than the closed form log-log fit, see fit_invf (Default = True)
+    :returns: List of result dictionaries, in the order of tasks
+    
+    """
+    tasks = [[task, [0, 0]] if isinstance(task, str) else task for task in tasks]
+    if processes == 1:  # in this process, eg to profile it
+        spectra = list(map(noise_spectrum, [task[0] for task in tasks], [task[1] for task in tasks]))
+    else:
+        with ProcessPoolExecutor(max_workers = processes) as pool:
+            spectra = list(pool.map(noise_spectrum, [task[0] for task in tasks], [task[1] for task in tasks]))
+    results = fit_spectra(spectra, noise_lims, threshold, refine)
+    if output is not None:
+        write_noise_table(results, output)
+    return results
+
+PLATEAU_TABLE_COLUMNS = ['file', 'start', 'stop', 'voltage', 'mean_current', 'conductance', 'I_rms', 'A',
+                         'alpha', 'fit_a', 'cov_a_a', 'cov_a_alpha', 'cov_alpha_alpha', 'error']
+
+def plateau_spectrum(fname, plateau, channel = 0):
+    """Read one constant voltage plateau of a file and take its Welch PSD, leaving the fit to fit_spectra
+    
+    :param fname: Filename of .hkd file to be processed
+    :param plateau: Plateau as [first_sample, last_sample, voltage], see HekaReader.get_voltage_plateaus
+    :param channel: Index of the channel to analyse (Default = 0)
+    :returns: [result, f, psd, mean_i] as from noise_spectrum, result holding the PLATEAU_TABLE_COLUMNS
+    
+    """
+    first_sample, last_sample, voltage = plateau
+    result = dict((column, '') for column in PLATEAU_TABLE_COLUMNS)
+    result.update(file = fname, voltage = voltage)
+    try:
+        reader = heka.HekaReader(fname, prefetch = 2)
+        try:
+            fs = reader.get_sample_rate()
+            result.update(start = first_sample/fs, stop = last_sample/fs)
+            accumulator = accumulate_psd(reader, first_sample, last_sample, channel = channel)
+        finally:
+            reader.close_file()
+        psd, f, pspec, fspec = accumulator.result()
+        result['I_rms'] = np.sqrt(pspec.max())
+        return [result, f, psd, accumulator.mean()]
+    except Exception as e:  # keep going with the other plateaus
+        result['error'] = "%s: %s" % (type(e).__name__, e)
+        return [result, None, None, None]
+
+def plateau_summary(fname, plateau, noise_lims = [3, 1e3], threshold = 0, channel = 0, refine = True):
+    """Noise and conductance of one constant voltage plateau of a file
+    
+    :param fname: Filename of .hkd file to be processed
+    :param plateau: Plateau as [first_sample, last_sample, voltage], see HekaReader.get_voltage_plateaus
+    :returns: Dictionary with the PLATEAU_TABLE_COLUMNS; times in s, voltage in V, current in nA, conductance in nS
+    
+    """
+    return fit_spectra([plateau_spectrum(fname, plateau, channel)], noise_lims, threshold, refine)[0]
+
+def plateau_noise(fname, noise_lims = [3, 1e3], threshold = 0, settle = 0, min_duration = 0, channel = 0,
+                  processes = None, output = None, refine = True):
+    """IV and noise characterization from the constant voltage plateaus of a single .hkd file
+    
+    Plateaus are found from the block voltages alone; each is then read once
+    in its own worker process, and their spectra are fitted together.
+    
+    :param fname: Filename of .hkd file to be processed
+    :param noise_lims: Frequency range in Hz of the 1/f fit (Default = [3, 1e3])
+    :param threshold: PSD outlier threshold, see noise_fit_stats (Default = 0)
+    :param settle: Time in s skipped at the start of every plateau to let transients decay (Default = 0)
+    :param min_duration: Plateaus shorter than this many s after settling are skipped (Default = 0)
+    :param channel: Index of the channel to analyse (Default = 0)
+    :param processes: Number of worker processes (Default = number of CPUs)
+    :param output: Filename of a .csv results table to write (Default = None)
+    :param refine: Least squares on the PSD rather than the closed form log-log fit, see fit_invf (Default = True)
+    :returns: List of result dictionaries, one for each plateau in time order
+    
+    """
+    reader = heka.HekaReader(fname)
+    fs = reader.get_sample_rate()
+    plateaus = reader.get_voltage_plateaus(channel)
+    reader.close_file()
+    plateaus = [[first + int(settle*fs), last, voltage] for first, last, voltage in plateaus]
+    plateaus = [plateau for plateau in plateaus
+                if plateau[1] > plateau[0] and (plateau[1] - plateau[0])/fs >= min_duration]
+    spectrum = partial(plateau_spectrum, fname, channel = channel)
+    if processes == 1:
+        spectra = list(map(spectrum, plateaus))
+    else:
+        with ProcessPoolExecutor(max_workers = processes) as pool:
+            spectra = list(pool.map(spectrum, plateaus))
+    results = fit_spectra(spectra, noise_lims, threshold, refine)
+    if output is not None:
+        write_noise_table(results, output, PLATEAU_TABLE_COLUMNS)
+    return results
+
+def spectrogram_windows(fname, windows, channel = 0, nperseg = 2**16):
+    """Spectra of consecutive windows of a file, the work of one noise_spectrogram task
+    
+    :param fname: Filename of .hkd file to be processed
+    :param windows: List of [first_sample, last_sample], each at least nperseg samples long
+    :returns: [psd, mean_i, results]: 2D numpy array with the PSD in pA^2/Hz of each window, their
+        mean currents in pA and a list of dictionaries with the PLATEAU_TABLE_COLUMNS, holding
+        the voltage at the start of each window and I_rms, without the fit
+    
+    """
+    psds = np.empty((len(windows), nperseg//2 + 1))
+    means = np.empty(len(windows))
+    results = []
+    with heka.HekaReader(fname, prefetch = 2) as reader:
+        fs = reader.get_sample_rate()
+        voltages = reader.get_block_voltages()[:, reader.get_channel_indices(channel)[0]]
+        for k, (first_sample, last_sample) in enumerate(windows):
+            voltage = voltages[first_sample//reader.block_size]
+            result = dict((column, '') for column in PLATEAU_TABLE_COLUMNS)
+            result.update(file = fname, start = first_sample/fs, stop = last_sample/fs, voltage = voltage)
+            accumulator = accumulate_psd(reader, first_sample, last_sample, channel = channel, nperseg = nperseg)
+            psd, f, pspec, fspec = accumulator.result()
+            psds[k] = psd
+            means[k] = accumulator.mean()
+            result['I_rms'] = np.sqrt(pspec.max())
+            results.append(result)
+    return [psds, means, results]
+
+def noise_spectrogram(fname, window = 10.0, start = 0, stop = 0, noise_lims = [3, 1e3], threshold = 0, channel = 0,
+                      nperseg = 2**16, processes = None, output = None, refine = True):
+    """Time resolved noise of a .hkd file: Welch PSD, I_rms and 1/f fit of consecutive windows
+    
+    The time range is tiled into windows, dropping a trailing partial one. The
+    windows are split into contiguous groups, each analysed by a worker process
+    that reads only its own range of blocks. The spectra of all windows are then
+    fitted together by fit_invf.
+    
+    :param fname: Filename of .hkd file to be processed
+    :param window: Length of each window in s (Default = 10)
+    :param start: Start of the time range in s (Default = 0)
+    :param stop: End of the time range in s, 0 reads to the end of the file (Default = 0)
+    :param noise_lims: Frequency range in Hz of the 1/f fit (Default = [3, 1e3])
+    :param threshold: PSD outlier threshold, see noise_fit_stats (Default = 0)
+    :param channel: Index or name of the channel to analyse (Default = 0)
+    :param nperseg: Samples per Welch segment, sets the frequency resolution (Default = 2**16)
+    :param processes: Number of worker processes, 1 runs in this process (Default = number of CPUs)
+    :param output: Filename of a .npz file to write start, stop and voltage of the windows, f and
+        psd, stored as float32 (Default = None)
+    :param refine: Least squares on the PSD rather than the closed form log-log fit, see fit_invf (Default = True)
+    :returns: [times, f, psd, results]: times as [start, stop] in s for each window, frequencies in Hz,
+        the PSD in pA^2/Hz with one row per window and a list of result dictionaries with the
+        PLATEAU_TABLE_COLUMNS, see write_noise_table
+    
+    """
+    from scipy import fft as sp_fft
+    with heka.HekaReader(fname) as reader:
+        fs = reader.get_sample_rate()
+        first_sample, last_sample = reader.get_sample_range(start, stop)
+    window_samples = int(round(window*fs))
+    if window_samples < nperseg:
+        raise ValueError('Windows of %g s are shorter than one Welch segment of %d samples' % (window, nperseg))
+    windows = [[first, first + window_samples]
+               for first in range(first_sample, last_sample - window_samples + 1, window_samples)]
+    if processes == 1:
+        groups = [windows]
+    else:
+        n_groups = min(len(windows), 4*(processes or os.cpu_count() or 1))
+        groups = [list(group) for group in np.array_split(np.asarray(windows, dtype = np.int64), n_groups)] \
+            if windows else []
+    analyse = partial(spectrogram_windows, fname, channel = channel, nperseg = nperseg)
+    if processes == 1:  # in this process, eg to profile it
+        parts = list(map(analyse, groups))
+    else:
+        with ProcessPoolExecutor(max_workers = processes) as pool:
+            parts = list(pool.map(analyse, groups))
+    psd = np.concatenate([part[0] for part in parts]) if parts else np.empty((0, nperseg//2 + 1))
+    mean_i = np.concatenate([part[1] for part in parts]) if parts else np.empty(0)
+    results = [result for part in parts for result in part[2]]
+    times = np.asarray(windows, dtype = np.float64).reshape(-1, 2)/fs
+    f = sp_fft.rfftfreq(nperseg, 1/fs)
+    fits = noise_fit_table(f, psd, [result['I_rms'] for result in results], mean_i, noise_lims, threshold, refine)
+    for result, stats in zip(results, fits):
+        result.update(stats)
+        result['conductance'] = result['mean_current']/result['voltage'] if result['voltage'] != 0 else np.nan
+    if output is not None:
+        np.savez(output, start = times[:, 0], stop = times[:, 1], f = f, psd = psd.astype(np.float32),
+                 voltage = np.asarray([result['voltage'] for result in results], dtype = np.float64))
+    return [times, f, psd, results]
+
+def write_noise_table(results, fname, columns = NOISE_TABLE_COLUMNS):
+    """Save noise_summary, plateau_summary or noise_spectrogram results as a .csv table with one row per window
+    
+    :param results: List of result dictionaries
+    :param fname: Filename of the .csv file
+    :param columns: Columns of the table (Default = NOISE_TABLE_COLUMNS)
+    
+    """
+    with open(fname, 'w', newline = '') as f_obj:
+        writer = csv.DictWriter(f_obj, fieldnames = columns)
+        writer.writeheader()
+        writer.writerows(results)
+
+def batch_main(argv = None):
+    """Command line entry point for noise_batch, same as the noise command of pyporeutils"""
+    from . import cli
+    cli.main(['noise'] + list(sys.argv[1:] if argv is None else argv))
+
+# LIMITS FOR DATA EXTRACTION ([0, 0] = ENTIRE RANGE)
+extract_lims = [[0, 0], [4.5, 7]]
+
+# LIMITS FOR 1/F NOISE CURVE FITTING
+noise_lims = [3, 1e3]
+
+# PLOT OPTIONS: [VOLTAGE & CURRENT, CURRENT, NOISE]
+options = [[True, False, False], [True, True, True]]
+
+# SELECT PLOT OPTION (0 PLOTS ENTIRE RANGE, OTHER INDICES PLOT THE SECOND RANGE FROM extract_lims)
+option_select = 1
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        batch_main()
+    else:
+        final = noise("Data/PQ_Noise_1VPulse_181827.hkd", [[0,0], [23, 27.3]], noise_lims, option_select = 1, view = False)       #23-28
+        final2 = noise("Data/ChipPF.hkd", [[0,0], [15.6, 19]], noise_lims, option_select = 1, view = False)            #17.9-22.2
+        plot_noise([False, True, True], [final, final2], view_fit = True)
+        get_pyplot().show()
\ No newline at end of file
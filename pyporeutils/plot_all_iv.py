@@ -0,0 +1,311 @@
+#!/usr/bin/env python
+
+""""
+Plot and/or save IV data from .hkr files
+"""
+
+import numpy as np
+import hashlib
+import json
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+from . import instrument
+
+@instrument.timed('hkr parse')
+def csv_reader(file_obj, invert = False, limit = []):
+    """Extract current and voltage information from .hkr files
+    
+    :param file_obj: File to be read
+    :param invert: Invert both current and voltage (Default = False)
+    :param limit: Limit data extraction based on voltage limit in V provided as a list of 2 floats; order of list not important (Default = [])
+    :returns: Numpy array of current and voltage in nA and V, respectively          
+    
+    """
+    # Parse only the two needed tab-separated columns, straight into arrays
+    header = file_obj.readline().rstrip("\r\n").split("\t")
+    columns = np.loadtxt(file_obj, delimiter = "\t", ndmin = 2,
+                         usecols = (header.index("Current Avg"), header.index("Voltage")))
+    inverter = 1 if invert == False else -1
+    i = inverter*columns[:, 0]*1e9   # Current in nA
+    v = inverter*columns[:, 1]       # Voltage in V
+    if(len(limit) == 2):
+        in_limit = (v <= max(limit)) & (v >= min(limit))
+        i = i[in_limit]
+        v = v[in_limit]
+    return np.asarray([i,v])
+
+def load_hkr(fname, invert = False, limit = []):
+    """Extract current and voltage information from an .hkr file
+    
+    :param fname: Filename of .hkr file to be read
+    :param invert: Invert both current and voltage (Default = False)
+    :param limit: Limit data extraction based on voltage limit in V provided as a list of 2 floats (Default = [])
+    :returns: Numpy array of current and voltage in nA and V, respectively
+    
+    """
+    with open(fname, 'r') as f_obj:
+        return csv_reader(f_obj, invert = invert, limit = limit)
+
+def unique(arr):
+    """Ascendingly sort array with only unique elements
+    
+    :param arr: Array to be processed
+    :returns: Sorted unique array
+    
+    """
+    return np.unique(arr)
+
+def avg_currents(currents, voltages):
+    """Generate average currents for corresponding voltages
+    
+    :param currents: Current numpy array
+    :param voltages: Voltage numpy array
+    :returns: Numpy array of average currents and corresponding voltages
+    
+    """
+    u_voltages, u_indices = np.unique(voltages, return_inverse = True)
+    u_current = np.bincount(u_indices, weights = currents)/np.bincount(u_indices)
+    return np.asarray([u_current, u_voltages])
+
+def di_dv(currents, voltages):
+    """Generate change in conductance with voltage
+    
+    :param currents: Current numpy array
+    :param voltages: Voltage numpy array
+    :returns: Numpy array of discrete dI/dV and corresponding voltages in nS and V, respectively
+    
+    """
+    if(len(unique(voltages)) != len(voltages)):
+        currents, voltages = avg_currents(currents, voltages)
+    v_step = (np.max(voltages)-np.min(voltages))/len(voltages)*1.0
+    dS = np.diff(currents)/v_step
+    dv = voltages+v_step
+    return ([dS, dv[:-1]])
+
+def conductance(currents, voltages):
+    """Conductance from the best linear fit of an IV curve
+    
+    :param currents: Current numpy array in nA
+    :param voltages: Voltage numpy array in V
+    :returns: Numpy array of slope (G in nS) and intercept (nA) of the fit
+    
+    """
+    return np.polyfit(voltages, currents, 1)
+
+def iv_output_name(fname, location = []):
+    """Name, without extension, of the .csv and .png files plot_iv saves for a file
+    
+    :param fname: Filename of .hkr file
+    :param location: Location option of plot_iv (Default = [])
+    :returns: Output filename without extension
+    
+    """
+    if(len(location) == 2): # If location is given
+        [raw_fname, dirname] = location
+        return dirname+"/"+raw_fname[-19:-4]
+    else:   # Or else store in folder of file
+        return fname[:-4]
+
+def plot_iv(fname, save_plot = False, save_data = True, location = [], didv = False, avg = True, fit = False, show_g = True, invert = False, limit = []):
+    """Plot or save IV, linear fit and dI/dV characteristics in .png and .csv files, respectively
+    
+    :param fname: Filename of .hkr file to be processed
+    :param save_plot: Save plot in a .png file in same location as file or (location) option, if provided (Default = False)
+    :param save_data: Save data in a .csv file in same location as file or (location) option, if provided (Default = True)
+    :param location: Location of file to be saved as a 2 string list of the format [raw filename, directory name] (Default = [])
+    :param didv: Plot or save dI/dV characteristics (Default = False)
+    :param avg: Plot or save averaged currents and corresponding voltages (Default = True)
+    :param fit: Plot best linear fit (Default = False)
+    :param show_g: Show G from best linear fit in graph (Default = True)
+    :param invert: Invert both current and voltage (Default = False)
+    :param limit: Limit data extraction based on voltage limit provided as a list of 2 floats; order of list not important (Default = [])
+    
+    """
+    import matplotlib.pyplot as plt
+    with open(fname, 'r') as f_obj:
+        i, v = csv_reader(f_obj, invert = invert, limit = limit)
+        if(avg == True):
+            i, v = avg_currents(i, v)
+        fig = plt.figure("IV")
+        ax = plt.subplot(111)
+        ax.scatter(v, i)
+        
+        if(didv == True):
+            fig2 = plt.figure("dI_dV")
+            ax2 = plt.subplot(111)
+            dS, dv = di_dv(i, v)
+            ax2.scatter(dv, dS)
+            dv_lim = (np.max(dv)-np.min(dv))/len(dv)*10.0
+            dS_lim = np.max(dS)/len(dS)*10.0
+            ax2.set_xlim([np.min(dv)-dv_lim, np.max(dv)+dv_lim])
+            ax2.set_ylim([0, np.max(dS)+dS_lim])
+            ax2.set_xlabel("Voltage (V)", size = "large")
+            ax2.set_ylabel("dI/dV (nS)", size = "large")
+       
+        g = conductance(i, v)
+        lin = np.poly1d(g)
+        if(fit == True):
+            ax.plot(v, lin(v))
+        print("G = %0.2f nS" % g[0])
+    
+        v_lim = (np.max(v)-np.min(v))/len(v)*10.0
+        ax.set_xlim([np.min(v)-v_lim, np.max(v)+v_lim])
+        ax.set_xlabel("Voltage (V)", size = "large")
+        ax.set_ylabel("Ionic current (nA)", size = "large")
+        if(show_g == True):
+            ax.text(0.7, 0.1,("G = %0.2f nS" % (g[0])),
+             horizontalalignment='left',
+             verticalalignment='center',
+             transform = ax.transAxes)
+        
+        final_fname = iv_output_name(fname, location)
+        d_final_fname = final_fname+"_didv"
+        
+        if(save_data == True):
+            # Save in csv with voltage in V and current in A
+            np.savetxt(final_fname+".csv", np.transpose([v, i*1e-9]), delimiter=",")
+            if(didv == True):
+                # Save in csv with voltage in V and current in nS
+                np.savetxt(d_final_fname+".csv", np.transpose([dv, dS]), delimiter=",")
+        
+        if(save_plot == True):
+            with instrument.stage('render'):
+                fig.savefig(final_fname+".png", dpi=300, bbox_inches = "tight")
+                fig.clf()
+                if(didv == True):
+                    fig2.savefig(d_final_fname+".png", dpi=300, bbox_inches = "tight")
+                    fig2.clf()
+        else:
+            plt.show()
+
+def recursive_plot(main_dirname, sub_folder = ''):
+    """Process IV data recursively from a folder
+    
+    :param main_dirname: Name of directory to look for .hkr files
+    :param sub_folder: Name of subdirectory where plots and generated data will be saved (Default = '')
+    
+    """
+    for dirname, dirnames, filenames in os.walk(main_dirname):
+        print("------------------")
+        print(dirname)
+        print("------------------")
+        for filename in filenames:
+            if(filename[-4:] == '.hkr'):
+                if(not os.path.isdir(dirname+sub_folder)):
+                    os.mkdir(dirname+sub_folder)
+                plot_iv(os.path.join(dirname, filename), save_plot = True, location = [filename, dirname+sub_folder], didv = True)
+
+
+def file_digest(fname):
+    """SHA-1 hex digest of a file's contents"""
+    digest = hashlib.sha1()
+    with open(fname, 'rb') as f_obj:
+        for chunk in iter(lambda: f_obj.read(2**20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def plot_iv_job(job):
+    """Render and save one file for batch_plot in a worker process
+    
+    :param job: List of [fname, location, options], options being plot_iv keyword arguments
+    :returns: Error message, or None on success
+    
+    """
+    import matplotlib.pyplot as plt
+    fname, location, options = job
+    plt.switch_backend("Agg")   # no display needed to save figures
+    try:
+        plot_iv(fname, save_plot = True, location = location, **options)
+    except Exception as e:
+        return "%s: %s" % (type(e).__name__, e)
+    finally:
+        plt.close('all')
+    return None
+
+def batch_plot(main_dirname, sub_folder = '', processes = None, force = False, manifest_name = '.plot_iv_manifest.json', **options):
+    """Process IV data recursively from a folder in parallel, skipping files whose outputs are current
+    
+    A manifest in main_dirname records the size, modification time, hash and options of every
+    processed .hkr file. A file is processed again only if it changed, the options changed or
+    one of its .csv/.png outputs is missing.
+    
+    :param main_dirname: Name of directory to look for .hkr files
+    :param sub_folder: Name of subdirectory where plots and generated data will be saved (Default = '')
+    :param processes: Number of worker processes (Default = number of CPUs)
+    :param force: Process every file regardless of the manifest (Default = False)
+    :param manifest_name: Filename of the manifest inside main_dirname (Default = '.plot_iv_manifest.json')
+    :param options: plot_iv keyword arguments (Default = didv = True)
+    :returns: Dictionary of lists of 'plotted', 'skipped' and 'failed' filenames
+    
+    """
+    options = dict(dict(didv = True), **options)
+    manifest_fname = os.path.join(main_dirname, manifest_name)
+    try:
+        with open(manifest_fname, 'r') as f_obj:
+            manifest = json.load(f_obj)
+    except (IOError, ValueError):
+        manifest = {}
+    settings = dict(options, sub_folder = sub_folder)
+
+    jobs = []
+    entries = {}
+    summary = dict(plotted = [], skipped = [], failed = [])
+    for dirname, dirnames, filenames in os.walk(main_dirname):
+        for filename in filenames:
+            if(filename[-4:] != '.hkr'):
+                continue
+            fname = os.path.join(dirname, filename)
+            location = [filename, dirname+sub_folder]
+            key = os.path.relpath(fname, main_dirname)
+            stat = os.stat(fname)
+            entry = dict(size = stat.st_size, mtime_ns = stat.st_mtime_ns, options = settings)
+            previous = manifest.get(key, {})
+            if(previous.get('size') == entry['size'] and previous.get('mtime_ns') == entry['mtime_ns']):
+                entry['sha1'] = previous.get('sha1')
+            else:   # only hash files that look changed
+                entry['sha1'] = file_digest(fname)
+            outputs = [iv_output_name(fname, location)]
+            if(options.get('didv', False)):
+                outputs.append(outputs[0]+"_didv")
+            extensions = [".png", ".csv"] if options.get('save_data', True) else [".png"]
+            outputs = [output+extension for output in outputs for extension in extensions]
+            current = (previous.get('sha1') == entry['sha1'] and previous.get('options') == settings and
+                       all(os.path.isfile(name) for name in outputs))
+            if(current and not force):
+                summary['skipped'].append(fname)
+                manifest[key] = entry
+                continue
+            if(not os.path.isdir(dirname+sub_folder)):
+                os.mkdir(dirname+sub_folder)
+            jobs.append([fname, location, options])
+            entries[fname] = [key, entry]
+
+    with ProcessPoolExecutor(max_workers = processes) as pool:
+        errors = list(pool.map(plot_iv_job, jobs))
+    for job, error in zip(jobs, errors):
+        key, entry = entries[job[0]]
+        if(error is None):
+            summary['plotted'].append(job[0])
+            manifest[key] = entry
+        else:
+            print("%s: %s" % (job[0], error))
+            summary['failed'].append(job[0])
+            manifest.pop(key, None)
+
+    # replace the manifest in one step so an interrupted run never leaves it half written
+    handle, temp_fname = tempfile.mkstemp(dir = main_dirname)
+    with os.fdopen(handle, 'w') as f_obj:
+        json.dump(manifest, f_obj, indent = 1, sort_keys = True)
+    os.replace(temp_fname, manifest_fname)
+    return summary
+
+
+
+if __name__ == '__main__':
+    plot_iv("Data/Chip_PF.hkr", save_plot = False, save_data = False, didv = True)
+    dirname = './Data/IV/Final'
+    img_folder = "/IV"
+    #recursive_plot(dirname, img_folder)
+    #batch_plot(dirname, img_folder)
\ No newline at end of file
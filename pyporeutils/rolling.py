@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+
+"""
+Rolling statistics of .hkd recordings, computed in one streaming pass
+"""
+
+import numpy as np
+
+from . import heka_reader as heka
+from . import instrument
+
+def get_rolling_dtype(percentiles = []):
+    """
+    :param percentiles: Percentiles included, each as a field p<q> (Default = [])
+    :returns: Structured dtype of one window: start and stop in s, voltage in V and the current statistics in A
+    """
+    fields = ['start', 'stop', 'voltage', 'mean', 'std', 'rms', 'min', 'max'] + ['p%g' % q for q in percentiles]
+    return np.dtype([(field, np.float64) for field in fields])
+
+class RollingStats:
+    """Statistics of windows of a trace fed chunk by chunk
+
+    Windows of window samples start every step samples. Samples of windows
+    not complete at the end of a chunk are kept and completed by the next
+    chunk, and with step > window the gap after the last window is skipped
+    in the following chunks, so the result does not depend on how the trace
+    is chunked. Sums are taken relative to the first sample of each chunk,
+    which keeps the variance accurate on a large baseline current.
+
+    """
+    def __init__(self, fs, window, step = None, percentiles = [], offset = 0):
+        """
+        :param fs: Sample rate in Hz
+        :param window: Number of samples per window
+        :param step: Number of samples between window starts (Default = window)
+        :param percentiles: Percentiles of each window to compute, eg [5, 50, 95] (Default = [])
+        :param offset: Index of the first sample that will be fed (Default = 0)
+        """
+        self.fs = fs
+        self.window = int(window)
+        self.step = self.window if step is None else int(step)
+        if self.window < 1 or self.step < 1:
+            raise ValueError('Window and step must be at least one sample')
+        self.percentiles = list(percentiles)
+        self.dtype = get_rolling_dtype(self.percentiles)
+        self.position = offset  # index of the first sample of the buffer
+        self.buffer = np.empty(0)
+        self.voltage_buffer = np.empty(0)
+        self.skip = 0  # samples between windows not fed yet, when step > window
+
+    @instrument.timed('rolling stats')
+    def update(self, current, voltage):
+        """Add the next samples of the trace
+
+        :param current: 1D numpy array of current following the previous chunk
+        :param voltage: 1D numpy array of the voltage of the same samples
+        :returns: Numpy array of the windows completed by these samples
+
+        """
+        skipped = min(self.skip, len(current))
+        self.skip -= skipped
+        self.position += skipped
+        data = np.concatenate((self.buffer, current[skipped:]))
+        voltages = np.concatenate((self.voltage_buffer, voltage[skipped:]))
+        n_windows = (len(data) - self.window)//self.step + 1 if len(data) >= self.window else 0
+        stats = np.empty(n_windows, dtype = self.dtype)
+        if n_windows > 0:
+            starts = np.arange(n_windows)*self.step
+            reference = data[0]
+            sums = np.concatenate(([0], np.cumsum(data - reference)))
+            squares = np.concatenate(([0], np.cumsum((data - reference)**2)))
+            mean = (sums[starts + self.window] - sums[starts])/self.window
+            variance = np.maximum((squares[starts + self.window] - squares[starts])/self.window - mean**2, 0)
+            stats['start'] = (self.position + starts)/self.fs
+            stats['stop'] = (self.position + starts + self.window)/self.fs
+            stats['voltage'] = voltages[starts]
+            stats['mean'] = reference + mean
+            stats['std'] = np.sqrt(variance)
+            stats['rms'] = np.sqrt(stats['mean']**2 + variance)
+            windows = np.lib.stride_tricks.sliding_window_view(data, self.window)[::self.step][:n_windows]
+            stats['min'] = windows.min(axis = 1)
+            stats['max'] = windows.max(axis = 1)
+            if self.percentiles:
+                values = np.percentile(windows, self.percentiles, axis = 1)
+                for q, value in zip(self.percentiles, values):
+                    stats['p%g' % q] = value
+        consumed = min(n_windows*self.step, len(data))
+        self.skip += n_windows*self.step - consumed
+        self.buffer = data[consumed:].copy()
+        self.voltage_buffer = voltages[consumed:].copy()
+        self.position += consumed
+        return stats
+
+def rolling_stats(fname, window = 1.0, step = None, start = 0, stop = 0, channel = 0, percentiles = [],
+                  chunk_size = 2**20, output = None):
+    """Rolling mean, std, RMS, extremes and percentiles of the current of a .hkd file
+
+    The file is read once, chunk by chunk, so memory use does not depend on its
+    length. A trailing incomplete window is dropped.
+
+    :param fname: Filename of .hkd file to be processed
+    :param window: Length of each window in s (Default = 1)
+    :param step: Time between window starts in s (Default = window)
+    :param start: Start of the time range in s (Default = 0)
+    :param stop: End of the time range in s, 0 reads to the end of the file (Default = 0)
+    :param channel: Index or name of the channel to analyse (Default = 0)
+    :param percentiles: Percentiles of each window to compute, eg [5, 50, 95] (Default = [])
+    :param chunk_size: Samples decoded at once (Default = 2**20)
+    :param output: Filename of a .csv table to write (Default = None)
+    :returns: Numpy array with one entry per window, see get_rolling_dtype
+
+    """
+    with heka.HekaReader(fname, prefetch = 2) as reader:
+        fs = reader.get_sample_rate()
+        first_sample, last_sample = reader.get_sample_range(start, stop)
+        window_samples = max(1, int(round(window*fs)))
+        step_samples = window_samples if step is None else max(1, int(round(step*fs)))
+        stats = RollingStats(fs, window_samples, step_samples, percentiles, offset = first_sample)
+        name = reader.get_channel_names(channel)[0]
+        results = [stats.update(current[name], voltage[name]) for offset, current, voltage
+                   in reader.iter_chunks(chunk_size, 0, first_sample, last_sample, channels = channel)]
+    results = np.concatenate(results) if results else np.empty(0, dtype = stats.dtype)
+    if output is not None:
+        write_rolling_stats(results, output)
+    return results
+
+def write_rolling_stats(stats, fname):
+    """Save rolling statistics as .csv
+
+    :param stats: Numpy array returned by rolling_stats
+    :param fname: Filename of the .csv file
+
+    """
+    np.savetxt(fname, stats.view(np.float64).reshape(len(stats), -1), delimiter = ",",
+               header = ",".join(stats.dtype.names), comments = "")
@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+
+"""
+Write synthetic .hkd and .hkr files for testing and benchmarking
+"""
+
+import numpy as np
+
+HKD_HEADER = (b'Nanopore Experiment Data File V2.0\r\n'
+              b'Synthetic recording written by pyporeutils\r\n'
+              b'End of file format\r\n')
+
+PER_FILE_PARAMS = [[b'Points per block', np.dtype('>u4')], [b'Sampling interval', np.dtype('>f8')]]
+PER_BLOCK_PARAMS = [[b'Block index', np.dtype('>u4')]]
+PER_CHANNEL_PARAMS = [[b'Scale', np.dtype('>f8')], [b'Voltage', np.dtype('>f8')]]
+
+def param_list_bytes(param_list, name_dtype):
+    """Encode a header parameter list: 3 null bytes, the count, then a type code and name per parameter"""
+    from . import heka_reader as heka
+    codes = [heka.ENCODINGS.index(dtype) for name, dtype in param_list]
+    entries = np.empty(len(param_list), dtype = [('code', '>u1'), ('name', name_dtype)])
+    entries['code'] = codes
+    entries['name'] = [name for name, dtype in param_list]
+    return b'\x00\x00\x00' + np.uint8(len(param_list)).tobytes() + entries.tobytes()
+
+def pink_noise(n, rng):
+    """White noise shaped to a 1/f power spectrum with unit standard deviation"""
+    spectrum = np.fft.rfft(rng.standard_normal(n))
+    scaling = np.ones(len(spectrum))
+    scaling[1:] = 1/np.sqrt(np.arange(1, len(spectrum)))
+    scaling[0] = 0
+    pink = np.fft.irfft(spectrum*scaling, n)
+    std = pink.std()
+    return pink/std if std > 0 else pink
+
+def write_hkd(fname, duration = 10, sample_rate = 1e5, block_size = 10000, channels = 1, voltages = [0.1],
+              step_duration = 0, conductance = 10e-9, noise_rms = 10e-12, flicker_rms = 0, event_rate = 0,
+              event_depth = 0.3, event_duration = 1e-3, seed = 0, chunk_blocks = 64):
+    """Write a synthetic .hkd recording of an open pore with voltage steps, noise and translocation events
+
+    The current of every channel is conductance*voltage plus white and 1/f
+    noise, with rectangular blockades at Poisson distributed times. The file
+    is written chunk_blocks blocks at a time, so memory use does not grow
+    with the duration.
+
+    :param fname: Filename of the .hkd file to be written
+    :param duration: Length of the recording in s, rounded up to whole blocks (Default = 10)
+    :param sample_rate: Sample rate in Hz (Default = 1e5)
+    :param block_size: Points per channel in each block (Default = 10000)
+    :param channels: Number of channels (Default = 1)
+    :param voltages: Voltage steps in V, cycled through (Default = [0.1])
+    :param step_duration: Length of each voltage step in s, rounded to whole blocks; 0 keeps the first voltage (Default = 0)
+    :param conductance: Open pore conductance in S (Default = 10e-9)
+    :param noise_rms: Standard deviation of the white noise in A (Default = 10e-12)
+    :param flicker_rms: Standard deviation of the 1/f noise in A (Default = 0)
+    :param event_rate: Mean number of events per s (Default = 0)
+    :param event_depth: Fraction of the open pore current blocked by an event (Default = 0.3)
+    :param event_duration: Mean, exponentially distributed, dwell time of events in s (Default = 1e-3)
+    :param seed: Seed of the random number generator (Default = 0)
+    :param chunk_blocks: Blocks generated at once (Default = 64)
+    :returns: Numpy array of [start, length] sample indices of the events written
+
+    """
+    rng = np.random.default_rng(seed)
+    num_blocks = int(np.ceil(duration*sample_rate/block_size))
+    total = num_blocks*block_size
+    step_blocks = max(1, int(round(step_duration*sample_rate/block_size))) if step_duration > 0 else num_blocks
+    block_voltages = np.asarray(voltages, dtype = np.float64)[(np.arange(num_blocks)//step_blocks) % len(voltages)]
+
+    # Events: Poisson arrivals, non overlapping
+    n_events = rng.poisson(event_rate*total/sample_rate)
+    starts = np.sort(rng.integers(0, total, n_events))
+    lengths = np.maximum(1, rng.exponential(event_duration*sample_rate, n_events)).astype(np.int64)
+    keep = np.concatenate(([True], starts[1:] >= starts[:-1] + lengths[:-1])) if n_events else np.ones(0, bool)
+    events = np.column_stack((starts[keep], np.minimum(lengths[keep], total - starts[keep])))
+
+    # One scale for the whole file, leaving room for 6 sigma of noise
+    peak = conductance*np.max(np.abs(voltages)) + 6*(noise_rms + flicker_rms)
+    scale = peak/32000 if peak > 0 else 1e-12
+
+    from . import heka_reader as heka
+    channel_list = [[bytes('Current %d' % c if channels > 1 else 'Current', 'utf-8'), np.dtype('>S512')]
+                    for c in range(channels)]
+    block_dtype = np.dtype([
+        ('block', heka.get_param_list_dtype(PER_BLOCK_PARAMS)),
+        ('channel', heka.get_param_list_dtype(PER_CHANNEL_PARAMS), (channels,)),
+        ('data', np.dtype('>i2'), (channels, block_size))])
+
+    with open(fname, 'wb') as f:
+        f.write(HKD_HEADER)
+        for param_list in [PER_FILE_PARAMS, PER_BLOCK_PARAMS, PER_CHANNEL_PARAMS]:
+            f.write(param_list_bytes(param_list, np.dtype('>S64')))
+        f.write(param_list_bytes(channel_list, np.dtype('>S512')))
+        f.write(np.array(block_size, dtype = '>u4').tobytes() + np.array(1/sample_rate, dtype = '>f8').tobytes())
+
+        for first_block in range(0, num_blocks, chunk_blocks):
+            last_block = min(first_block + chunk_blocks, num_blocks)
+            n = (last_block - first_block)*block_size
+            offset = first_block*block_size
+            open_current = conductance*np.repeat(block_voltages[first_block:last_block], block_size)
+            blocked = np.zeros(n + 1)
+            in_chunk = events[(events[:, 0] < offset + n) & (events[:, 0] + events[:, 1] > offset)]
+            np.add.at(blocked, np.clip(in_chunk[:, 0] - offset, 0, n), 1)
+            np.add.at(blocked, np.clip(in_chunk[:, 0] + in_chunk[:, 1] - offset, 0, n), -1)
+            open_current *= 1 - event_depth*np.cumsum(blocked[:-1])
+
+            records = np.zeros(last_block - first_block, dtype = block_dtype)
+            records['block']['Block index'] = np.arange(first_block, last_block)
+            records['channel']['Scale'] = scale
+            records['channel']['Voltage'] = block_voltages[first_block:last_block, np.newaxis]
+            for c in range(channels):
+                current = open_current + noise_rms*rng.standard_normal(n)
+                if flicker_rms > 0:
+                    current += flicker_rms*pink_noise(n, rng)
+                raw = np.clip(np.round(current/scale), -32768, 32767)
+                records['data'][:, c, :] = raw.reshape(-1, block_size)
+            f.write(records.tobytes())
+    return events
+
+def write_hkr(fname, voltages = np.linspace(-1, 1, 41), conductance = 10e-9, repeats = 1, noise_rms = 10e-12, seed = 0):
+    """Write a synthetic .hkr IV file with the columns read by plot_all_iv
+
+    :param fname: Filename of the .hkr file to be written
+    :param voltages: Voltages of the sweep in V (Default = 41 steps from -1 to 1 V)
+    :param conductance: Pore conductance in S (Default = 10e-9)
+    :param repeats: Number of times the sweep is repeated (Default = 1)
+    :param noise_rms: Standard deviation of the current noise in A (Default = 10e-12)
+    :param seed: Seed of the random number generator (Default = 0)
+
+    """
+    rng = np.random.default_rng(seed)
+    v = np.tile(np.asarray(voltages, dtype = np.float64), repeats)
+    i = conductance*v + noise_rms*rng.standard_normal(len(v))
+    table = np.column_stack((np.arange(len(v)), v, i, np.full(len(v), noise_rms)))
+    np.savetxt(fname, table, fmt = ['%d', '%g', '%e', '%.3e'], delimiter = "\t",
+               header = "Time\tVoltage\tCurrent Avg\tCurrent SD", comments = "")
@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+
+# CALCULATE POSSIBLE THICKNESS AND PORE DIAMETER FROM OPEN PORE CONDUCTANCE AND CHANGE IN CONDUCTANCE DURING NANOPARTICLE TRANSLOCATION
+
+import numpy as np
+import math
+
+# G0 = open pore conductance (nS)
+# dG = change in pore conductance when DNA translocates (nS)
+# sig = conductivity of KCl solution (S/m)
+# dnp = diameter of nanoparticle (nm)
+# dmax = maximum diameter of nanopore (nm)
+
+# thickness as a function of diameter and change in conductance
+def tdna(d, g0, dg, sig = 11.8, dnp = 2.15):
+    return (math.pi*sig*(d**2-dnp**2)/(g0-dg)/4-math.pi*np.sqrt(d**2-dnp**2)/4)
+
+# thickness as a function of diameter and open pore conductance
+def topen(d, g0, sig = 11.8):
+    return (math.pi*sig*(d**2)/(4*g0)-math.pi*d/4)
+
+def t_d_solve(g0, dg, sig = 11.8, dnp = 2.15, dmax = 10, n_grid = 256, tol = 1e-10, max_iter = 50):
+    """Solve tdna(d) = topen(d) for many pores at once
+    
+    All arguments broadcast against each other. The smallest root in [dnp, dmax] with
+    a positive thickness is bracketed on a grid of n_grid diameters, then refined with
+    Newton steps that fall back to bisection whenever they leave the bracket.
+    
+    :param g0: Open pore conductance(s) (nS)
+    :param dg: Change(s) in conductance during translocation (nS)
+    :param sig: Conductivity of the solution (S/m) (Default = 11.8)
+    :param dnp: Diameter of the nanoparticle (nm) (Default = 2.15)
+    :param dmax: Maximum diameter of the nanopore (nm) (Default = 10)
+    :param n_grid: Number of diameters used to bracket the root (Default = 256)
+    :param tol: Relative tolerance on the diameter (Default = 1e-10)
+    :param max_iter: Maximum number of refinement steps (Default = 50)
+    :returns: List of [d, t, converged]: diameters and thicknesses in nm (nan where no
+        root was found) and a boolean array marking the elements that converged
+    
+    """
+    arrays = np.broadcast_arrays(*[np.asarray(a, dtype=np.float64) for a in (g0, dg, sig, dnp, dmax)])
+    shape = arrays[0].shape
+    g0, dg, sig, dnp, dmax = [np.ravel(a) for a in arrays]
+
+    def difference(d):
+        return tdna(d, g0, dg, sig, dnp) - topen(d, g0, sig)
+
+    def slope(d):
+        return (math.pi*sig*d/(g0-dg)/2-math.pi*d/np.sqrt(d**2-dnp**2)/4) - (math.pi*sig*d/(2*g0)-math.pi/4)
+
+    # bracket the first sign change on a grid from dnp to dmax
+    grid = dnp[:, np.newaxis] + (dmax-dnp)[:, np.newaxis]*np.linspace(0, 1, n_grid)
+    t_grid = topen(grid, g0[:, np.newaxis], sig[:, np.newaxis])
+    h = tdna(grid, g0[:, np.newaxis], dg[:, np.newaxis], sig[:, np.newaxis], dnp[:, np.newaxis]) - t_grid
+    crossing = (np.sign(h[:, :-1]) != np.sign(h[:, 1:])) & np.isfinite(h[:, :-1]) & np.isfinite(h[:, 1:]) & \
+        (t_grid[:, :-1] > 0) & (t_grid[:, 1:] > 0)
+    found = crossing.any(axis=1)
+    first = np.argmax(crossing, axis=1)
+    rows = np.arange(len(g0))
+    lo, hi = grid[rows, first], grid[rows, first + 1]
+    h_lo, h_hi = h[rows, first], h[rows, first + 1]
+
+    # start from the secant point, then safeguarded Newton
+    with np.errstate(divide='ignore', invalid='ignore'):
+        d = np.where(h_hi != h_lo, lo - h_lo*(hi-lo)/(h_hi-h_lo), (lo+hi)/2)
+        converged = ~found | (h_lo == 0)
+        d = np.where(h_lo == 0, lo, d)
+        for _ in range(max_iter):
+            active = ~converged
+            if not active.any():
+                break
+            h_d = difference(d)
+            same_side = np.sign(h_d) == np.sign(h_lo)
+            lo = np.where(active & same_side, d, lo)
+            h_lo = np.where(active & same_side, h_d, h_lo)
+            hi = np.where(active & ~same_side, d, hi)
+            step = d - h_d/slope(d)
+            outside = ~np.isfinite(step) | (step <= lo) | (step >= hi)
+            new_d = np.where(outside, (lo+hi)/2, step)
+            done = (h_d == 0) | (np.abs(new_d-d) <= tol*np.abs(d))
+            d = np.where(active & (h_d != 0), new_d, d)
+            converged = converged | (active & done)
+    t = topen(d, g0, sig)
+    converged = converged & found & (t >= 0)
+    d = np.where(converged, d, np.nan)
+    t = np.where(converged, t, np.nan)
+    return [d.reshape(shape), t.reshape(shape), converged.reshape(shape)]
+
+def t_d_opt(g0, dg, sig = 11.8, dnp = 2.15, dmax = 10, plot = True):
+    """Solve for the diameter and thickness of one pore, printing and optionally plotting the solution
+    
+    :param plot: Plot both thickness curves and the solution (Default = True)
+    :returns: Numpy array of [d, t] in nm
+    
+    """
+    d_solv, t_solv, converged = t_d_solve(g0, dg, sig, dnp, dmax)
+    xsolv = np.asarray([d_solv, t_solv])
+    if converged:
+        print("d = %0.1f nm\nt = %0.1f nm" % (xsolv[0],xsolv[1]))
+    else:
+        print("No solution between d = %0.2f nm and %0.2f nm" % (dnp, dmax))
+
+    if plot:
+        import matplotlib.pyplot as plt
+
+        # range of diameter for nanopores with dmin = dnp
+        d = np.arange(dnp,dmax,0.001) # in nm
+        t_dg = tdna(d, g0, dg, sig, dnp)
+        t_g0 = topen(d, g0, sig)
+
+        fig = plt.figure()
+        sp = fig.add_subplot(111)
+
+        myplot = sp.plot(d,t_dg)
+        myplot2 = sp.plot(d,t_g0)
+
+        # plot solution with red marker 'o'
+        myplot3 = sp.plot(xsolv[0],xsolv[1],'ro')
+        plt.xlim([dnp,dmax])
+        plt.ylim([0,np.max([t_dg, t_g0])])
+        plt.xlabel('Effective nanopore diameter (nm)')
+        plt.ylabel('Effective nanopore thickness (nm)')
+
+        #plt.show()
+    return xsolv
+
+if __name__ == '__main__':
+    t_d_opt(69, 3)
@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+
+"""
+Extract time traces of current or conductance from .hkd file
+"""
+
+from . import heka_reader as heka
+from . import instrument
+
+def plot_trace(fname, start = 0, stop = 0, decimate = True, dec_rate = 2500, output = None, use_index = False):
+    """Plot current and voltage of a .hkd file against time
+    
+    :param fname: Filename of .hkd file to be plotted
+    :param start: Start of the window in s (Default = 0)
+    :param stop: End of the window in s, 0 plots to the end of the file (Default = 0)
+    :param decimate: Plot the max/min envelope of every dec_rate samples (Default = True)
+    :param dec_rate: Number of samples per decimation bin (Default = 2500)
+    :param output: Save the plot to this file instead of showing it (Default = None)
+    :param use_index: Take the envelope from the sidecar index, building it on first use; dec_rate is
+        rounded up to whole blocks so repeated overview plots decode no samples (Default = False)
+    
+    """
+    import matplotlib.pyplot as plt
+    reader = heka.HekaReader(fname, use_index = use_index)
+    if use_index:
+        dec_rate = reader.block_size * -(-dec_rate // reader.block_size)
+    i, t, sample_rate, v, total_length = reader.extract_data(start = start, stop = stop, decimate = decimate, dec_rate = dec_rate)
+    reader.close_file()
+    i = i*1e9
+
+    fig, ax1 = plt.subplots()
+
+    ax2 = ax1.twinx()
+
+    ax1.plot(t, i, 'black')
+    ax1.minorticks_on()
+    ax1.tick_params('both', length=8, width=1, which='major')
+    ax1.tick_params('both', length=4, width=1, which='minor')
+    ax1.set_xlabel('Time (s)')
+    ax1.set_ylabel('Current (nA)', color='black')
+
+    ax2.plot(t, v, 'red')
+    ax2.minorticks_on()
+    ax2.tick_params('both', length=8, width=1, which='major')
+    ax2.tick_params('both', length=4, width=1, which='minor')
+    ax2.set_ylabel('Voltage (V)', color='red')
+
+    if output is not None:
+        with instrument.stage('render'):
+            fig.savefig(output, dpi=300, bbox_inches = "tight")
+    else:
+        plt.show()
+    plt.close('all')
+
+if __name__ == '__main__':
+    plot_trace('Data/ChipAU.hkd', start = 0, stop = 0, decimate = True)